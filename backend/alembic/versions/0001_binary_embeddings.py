@@ -0,0 +1,73 @@
+"""binary embedding storage and provider tag on students
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+import struct
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# frozen copies of what the app used when this revision was written, so later
+# changes to backend.helpers cannot change what it does
+LEGACY_MODEL = "raw112"
+EMB_HEADER = struct.Struct("<2sBBI")  # magic, version, dtype code (1 = float16), dim
+BATCH = 200
+
+
+def _pack(vec):
+    vec = vec.astype(np.float16)
+    return EMB_HEADER.pack(b"SE", 1, 1, vec.shape[0]) + vec.tobytes()
+
+
+def _parse_csv(txt):
+    txt = (txt or "").strip()
+    if txt.startswith("[") and txt.endswith("]"):
+        txt = txt[1:-1]
+    if not txt:
+        return None
+    try:
+        return np.array([float(x) for x in txt.replace("\n", " ").split(",")], dtype=np.float32)
+    except ValueError:
+        return None
+
+
+def upgrade():
+    conn = op.get_bind()
+    cols = {c["name"] for c in sa.inspect(conn).get_columns("students")}
+    if "embedding_blob" not in cols:
+        conn.execute(sa.text("ALTER TABLE students ADD COLUMN embedding_blob BLOB"))
+    if "embedding_model" not in cols:
+        conn.execute(sa.text("ALTER TABLE students ADD COLUMN embedding_model VARCHAR(32)"))
+    # rows written before providers existed are raw-pixel embeddings
+    conn.execute(sa.text(
+        "UPDATE students SET embedding_model = :m WHERE embedding_model IS NULL "
+        "AND (embedding IS NOT NULL OR embedding_blob IS NOT NULL)"
+    ), {"m": LEGACY_MODEL})
+
+    # CSV text in students.embedding -> binary blob
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT id, embedding FROM students "
+            "WHERE embedding IS NOT NULL AND embedding_blob IS NULL LIMIT :n"
+        ), {"n": BATCH}).all()
+        if not rows:
+            break
+        for sid, txt in rows:
+            vec = _parse_csv(txt)
+            conn.execute(
+                sa.text("UPDATE students SET embedding_blob = :b, embedding = NULL WHERE id = :id"),
+                {"b": _pack(vec) if vec is not None else None, "id": sid},
+            )
+
+
+def downgrade():
+    # the CSV text is not restored; blobs stay readable by helpers.parse_embedding
+    pass
@@ -0,0 +1,30 @@
+"""indexes for the behaviors/sessions/students lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_behaviors_session_student", "behaviors", ["session_id", "student_id"]),
+    ("ix_behaviors_student_timestamp", "behaviors", ["student_id", "timestamp"]),
+    ("ix_sessions_teacher_id", "sessions", ["teacher_id"]),
+    ("ix_students_parent_id", "students", ["parent_id"]),
+]
+
+
+def upgrade():
+    for name, table, cols in INDEXES:
+        op.create_index(name, table, cols, if_not_exists=True)
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,42 @@
+"""pre-aggregated behavior_summaries rollup
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not sa.inspect(conn).has_table("behavior_summaries"):
+        op.create_table(
+            "behavior_summaries",
+            sa.Column("session_id", sa.Integer, sa.ForeignKey("sessions.id"), primary_key=True),
+            sa.Column("student_id", sa.Integer, sa.ForeignKey("students.id"), primary_key=True),
+            sa.Column("behavior", sa.String(32), primary_key=True),
+            sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+            sa.Column("first_seen", sa.DateTime),
+            sa.Column("last_seen", sa.DateTime),
+        )
+    op.create_index("ix_behavior_summaries_student_id", "behavior_summaries", ["student_id"],
+                    if_not_exists=True)
+    # backfill from the existing events (plain SQL: later model changes must
+    # not change what this revision does)
+    conn.execute(sa.text("DELETE FROM behavior_summaries"))
+    conn.execute(sa.text(
+        "INSERT INTO behavior_summaries "
+        "(session_id, student_id, behavior, count, first_seen, last_seen) "
+        "SELECT session_id, student_id, behavior, count(*), min(timestamp), max(timestamp) "
+        "FROM behaviors GROUP BY session_id, student_id, behavior"
+    ))
+
+
+def downgrade():
+    op.drop_table("behavior_summaries")
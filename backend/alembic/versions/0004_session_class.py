@@ -0,0 +1,26 @@
+"""class_name on sessions, so absentees come from the class roster
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    cols = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("sessions")}
+    if "class_name" not in cols:
+        op.add_column("sessions", sa.Column("class_name", sa.String(64), nullable=True))
+    op.create_index("ix_students_class_name", "students", ["class_name"], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index("ix_students_class_name", table_name="students", if_exists=True)
+    with op.batch_alter_table("sessions") as batch:
+        batch.drop_column("class_name")
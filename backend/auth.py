@@ -1,19 +1,43 @@
-import os, time, bcrypt, jwt
+import os, time, hashlib, threading, asyncio, bcrypt, jwt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, Query, Request
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from backend.db_models import User
 
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
 JWT_EXP_SECONDS = 60 * 60 * 12  # 12 hours
+BCRYPT_ROUNDS = int(os.getenv("SANAD_BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a few threads hash in parallel without
+# occupying the request threadpool
+HASH_WORKERS = int(os.getenv("SANAD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+JWT_CACHE_SIZE = int(os.getenv("SANAD_JWT_CACHE_SIZE", "1024"))
 
+_hash_executor = ThreadPoolExecutor(max_workers=max(1, HASH_WORKERS), thread_name_prefix="bcrypt")
 
-def hash_pw(plain: str) -> str:
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt()).decode()
+
+def hash_pw(plain: str, rounds: int = None) -> str:
+    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt(rounds or BCRYPT_ROUNDS)).decode()
 
 
 def check_pw(plain: str, hashed: str) -> bool:
     return bcrypt.checkpw(plain.encode(), hashed.encode())
 
 
+async def hash_pw_async(plain: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, hash_pw, plain)
+
+
+def hash_pw_pooled(plain: str) -> str:
+    """hash_pw for sync endpoints, still bounded by the bcrypt executor."""
+    return _hash_executor.submit(hash_pw, plain).result()
+
+
+async def check_pw_async(plain: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, check_pw, plain, hashed)
+
+
 def issue_jwt(user_id: int, email: str, is_teacher: bool) -> str:
     now = int(time.time())
     payload = {
@@ -26,8 +50,77 @@ def issue_jwt(user_id: int, email: str, is_teacher: bool) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
 
+class TokenCache:
+    """LRU of recently verified JWT payloads, keyed by sha256 of the token.
+
+    An entry is only served until the token's own `exp`, so caching never
+    extends a token's lifetime.
+    """
+
+    def __init__(self, maxsize=JWT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # digest -> payload
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                if payload.get("exp", 0) > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, token, payload):
+        if self.maxsize <= 0:
+            return
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
 def verify_jwt(token: str):
-    return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        token_cache.put(token, payload)
+    return payload
+
+
+def bearer_token(request: Request, token: str = None):
+    """Token from ?auth= (used by <img> stream URLs) or the Authorization header."""
+    if not token:
+        token = request.headers.get("Authorization", "")
+    if token.startswith("Bearer "):
+        token = token[7:].strip()
+    return token or None
+
+
+async def get_current_user(request: Request, auth: str = Query(None)):
+    """FastAPI dependency: the verified JWT payload, or 401."""
+    token = bearer_token(request, auth)
+    if not token:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        return verify_jwt(token)
+    except Exception:
+        raise HTTPException(401, "Unauthorized")
 
 
 def ensure_bootstrap_teacher(db: Session):
@@ -43,19 +136,27 @@ def ensure_bootstrap_teacher(db: Session):
         db.commit()
 
 
-def create_user(db: Session, name: str, email: str, password: str, is_teacher: bool):
-    if db.query(User).filter(User.email == email).first():
-        return {"error": "email exists"}
-    u = User(name=name, email=email, password_hash=hash_pw(password), is_teacher=is_teacher)
+def _user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def _add_user(db: Session, name: str, email: str, password_hash: str, is_teacher: bool):
+    u = User(name=name, email=email, password_hash=password_hash, is_teacher=is_teacher)
     db.add(u)
     db.commit()
     return {"ok": True, "id": u.id}
 
 
-def login(db: Session, email: str, password: str):
-    ensure_bootstrap_teacher(db)
-    u = db.query(User).filter(User.email == email).first()
-    if not u or not check_pw(password, u.password_hash):
+async def create_user(db: Session, name: str, email: str, password: str, is_teacher: bool):
+    if await run_in_threadpool(_user_by_email, db, email):
+        return {"error": "email exists"}
+    password_hash = await hash_pw_async(password)
+    return await run_in_threadpool(_add_user, db, name, email, password_hash, is_teacher)
+
+
+async def login(db: Session, email: str, password: str):
+    u = await run_in_threadpool(_user_by_email, db, email)
+    if not u or not await check_pw_async(password, u.password_hash):
         return {"error": "invalid credentials"}
     token = issue_jwt(u.id, u.email, u.is_teacher)
     return {"token": token, "user": u.to_dict()}
@@ -1,24 +1,73 @@
+import os
 import cv2
 import numpy as np
 import time
-import mediapipe as mp
+import threading
+from collections import OrderedDict
 
 # thresholds
 EAR_THRESHOLD = 0.25
 SLEEP_SECONDS = 5.0
 YAW_THRESHOLD = 25.0
 MAR_THRESHOLD = 0.6
-ABSENT_SECONDS = 3.0
+MAX_FACES = int(os.getenv("SANAD_MAX_FACES", "40"))
+# re-run FaceMesh on the crop of faces the full-frame pass could not find
+MESH_ROI_FALLBACK = os.getenv("SANAD_MESH_ROI_FALLBACK", "1") == "1"
+# per-face timers are dropped after this many seconds unseen, and a session
+# never keeps more than STATE_MAX_FACES of them
+STATE_TTL = float(os.getenv("SANAD_BEHAVIOR_STATE_TTL", "60"))
+STATE_MAX_FACES = int(os.getenv("SANAD_BEHAVIOR_STATE_MAX", "256"))
 
-_last_eye_open_time = {}
-_last_seen_time = {}
+class MeshSet:
+    """One camera's FaceMesh graphs and latest-mesh cache.
 
-_mp = mp.solutions.face_mesh
-_face_mesh = _mp.FaceMesh(static_image_mode=False,
-                          refine_landmarks=True,
-                          max_num_faces=1,
-                          min_detection_confidence=0.5,
-                          min_tracking_confidence=0.5)
+    MediaPipe graphs are not thread-safe and the full-frame graph tracks faces
+    across calls, so every room gets its own set (BehaviorStateStore owns
+    one). Graphs, and mediapipe itself, are created on first use; `lock`
+    serializes callers that share a set, like the module default.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame_mesh = None
+        self.face_mesh = None
+        # latest mesh per face key (track id or bbox cell), refreshed by mesh_faces()
+        self.cache = {}
+
+    def graphs(self):
+        if self.frame_mesh is None:
+            import mediapipe as mp
+            _mp = mp.solutions.face_mesh
+            # single crops come from different students, so no tracking state between calls
+            self.face_mesh = _mp.FaceMesh(static_image_mode=True,
+                                          refine_landmarks=True,
+                                          max_num_faces=1,
+                                          min_detection_confidence=0.5)
+            # whole classroom in one call; tracking across frames is valid here because
+            # this set only ever sees one camera
+            self.frame_mesh = _mp.FaceMesh(static_image_mode=False,
+                                           refine_landmarks=True,
+                                           max_num_faces=MAX_FACES,
+                                           min_detection_confidence=0.5,
+                                           min_tracking_confidence=0.5)
+        return self.frame_mesh, self.face_mesh
+
+    def warm(self):
+        """Build both graphs and run a blank image through each, so the
+        room's first live frame does not pay for graph setup."""
+        rgb = np.zeros((192, 192, 3), dtype=np.uint8)
+        with self.lock:
+            for g in self.graphs():
+                g.process(rgb)
+        return self
+
+    def close(self):
+        with self.lock:
+            for g in (self.frame_mesh, self.face_mesh):
+                if g is not None:
+                    g.close()
+            self.frame_mesh = self.face_mesh = None
+            self.cache.clear()
 
 LEFT_EYE_IDX = [33, 160, 158, 133, 153, 144]
 RIGHT_EYE_IDX = [362, 385, 387, 263, 373, 380]
@@ -41,41 +90,192 @@ def _face_key_from_bbox(bbox):
     cy = (y1 + y2) // 2
     return f"{cx//20}-{cy//20}"
 
-def classify_eye_state_on_roi(frame_bgr, bbox):
+class FaceState:
+    """Timers the behavior rules keep for one face between frames."""
+    __slots__ = ("eyes_open_at", "last_seen")
+
+    def __init__(self, now):
+        self.eyes_open_at = now
+        self.last_seen = now
+
+class BehaviorStateStore:
+    """Per-session FaceState records keyed by track or student id.
+
+    Records are kept in last-seen order: touch() moves a record to the end, so
+    evict() only has to pop stale records from the front. Past `max_faces`
+    the least recently seen record is dropped.
+    """
+
+    def __init__(self, ttl=STATE_TTL, max_faces=STATE_MAX_FACES):
+        self.ttl = ttl
+        self.max_faces = max(1, max_faces)
+        self._faces = OrderedDict()  # key -> FaceState
+        self.meshes = MeshSet()
+        self.evicted = 0
+
+    def touch(self, key, now):
+        st = self._faces.get(key)
+        if st is None:
+            st = self._faces[key] = FaceState(now)
+            while len(self._faces) > self.max_faces:
+                self._faces.popitem(last=False)
+                self.evicted += 1
+        else:
+            st.last_seen = now
+            self._faces.move_to_end(key)
+        return st
+
+    def evict(self, now):
+        cutoff = now - self.ttl
+        while self._faces:
+            key, st = next(iter(self._faces.items()))
+            if st.last_seen >= cutoff:
+                break
+            del self._faces[key]
+            self.evicted += 1
+
+    def reset(self):
+        self._faces.clear()
+        self.meshes.close()
+
+    def __len__(self):
+        return len(self._faces)
+
+# fallback for callers without a session (classify_behavior, draw_boxes)
+_default_state = BehaviorStateStore()
+
+class FaceAnalysis:
+    """Everything the behavior rules derive from one face in one frame."""
+    __slots__ = ("behavior", "eye_state", "ear", "mouth_state", "mar", "head_state", "yaw")
+
+    def __init__(self, behavior="attentive", eye_state="open", ear=1.0,
+                 mouth_state="closed", mar=0.0, head_state="forward", yaw=0.0):
+        self.behavior = behavior
+        self.eye_state = eye_state
+        self.ear = ear
+        self.mouth_state = mouth_state
+        self.mar = mar
+        self.head_state = head_state
+        self.yaw = yaw
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+def _clamped_roi(frame_bgr, bbox):
     h, w = frame_bgr.shape[:2]
     x1, y1, x2, y2 = bbox
     x1 = max(0, x1); y1 = max(0, y1)
     x2 = min(w - 1, x2); y2 = min(h - 1, y2)
     if x2 <= x1 or y2 <= y1:
-        return "open", 1.0
-
+        return None
     roi = frame_bgr[y1:y2, x1:x2]
-    if roi.size == 0:
-        return "open", 1.0
+    return roi if roi.size else None
+
+def face_mesh_points(frame_bgr, bbox, mesh_set=None):
+    """Run FaceMesh once on the face ROI; landmark pixels in ROI coords, or None."""
+    roi = _clamped_roi(frame_bgr, bbox)
+    if roi is None:
+        return None
 
     rgb = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
-    res = _face_mesh.process(rgb)
+    mesh_set = _default_state.meshes if mesh_set is None else mesh_set
+    with mesh_set.lock:
+        res = mesh_set.graphs()[1].process(rgb)
     if not res.multi_face_landmarks:
-        return "open", 1.0
+        return None
 
     lm = res.multi_face_landmarks[0].landmark
     rh, rw = roi.shape[:2]
-    def gather(idx_list):
-        return np.array([[lm[i].x * rw, lm[i].y * rh] for i in idx_list], dtype=np.float32)
+    return np.array([[p.x * rw, p.y * rh] for p in lm], dtype=np.float32)
+
+def _iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def mesh_faces(frame_bgr, bboxes, keys=None, mesh_set=None):
+    """Landmarks for every face of a frame from one FaceMesh call.
 
-    left_pts = gather(LEFT_EYE_IDX)
-    right_pts = gather(RIGHT_EYE_IDX)
+    Meshes are matched to the detector boxes by IoU and returned in each box's
+    ROI coordinates (same as face_mesh_points). Results are also cached under
+    `keys` in `mesh_set` (default: the module-wide set) so
+    classify_eye_state_on_roi / classify_mouth_state can reuse them.
+    """
+    mesh_set = _default_state.meshes if mesh_set is None else mesh_set
+    keys = keys or [_face_key_from_bbox(b) for b in bboxes]
+    out = [None] * len(bboxes)
+    if not bboxes:
+        mesh_set.cache.clear()
+        return out
+
+    h, w = frame_bgr.shape[:2]
+    rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    with mesh_set.lock:
+        res = mesh_set.graphs()[0].process(rgb)
+    meshes = []
+    for face in res.multi_face_landmarks or []:
+        pts = np.array([[p.x * w, p.y * h] for p in face.landmark], dtype=np.float32)
+        meshes.append((pts, (*pts.min(axis=0), *pts.max(axis=0))))
+
+    # greedy IoU assignment, best pairs first
+    pairs = sorted(
+        ((_iou(mb, b), mi, bi) for mi, (_, mb) in enumerate(meshes) for bi, b in enumerate(bboxes)),
+        reverse=True,
+    )
+    used_m, used_b = set(), set()
+    for score, mi, bi in pairs:
+        if score < 0.2:
+            break
+        if mi in used_m or bi in used_b:
+            continue
+        used_m.add(mi); used_b.add(bi)
+        x1, y1 = max(0, bboxes[bi][0]), max(0, bboxes[bi][1])
+        out[bi] = meshes[mi][0] - np.array([x1, y1], dtype=np.float32)
+
+    if MESH_ROI_FALLBACK:
+        for bi, b in enumerate(bboxes):
+            if out[bi] is None:
+                out[bi] = face_mesh_points(frame_bgr, b, mesh_set)
+
+    mesh_set.cache.clear()
+    mesh_set.cache.update(zip(keys, out))
+    return out
+
+_NO_MESH = object()
+
+def face_key(face):
+    """Timer/cache key of a detection: its track id, else its bbox grid cell."""
+    if face.get("track_id") is not None:
+        return f"t{face['track_id']}"
+    return _face_key_from_bbox(face["bbox"])
+
+def _cached_mesh(frame_bgr, bbox, key=None, mesh_set=None):
+    mesh_set = _default_state.meshes if mesh_set is None else mesh_set
+    key = key or _face_key_from_bbox(bbox)
+    if key in mesh_set.cache:
+        return mesh_set.cache[key]
+    return face_mesh_points(frame_bgr, bbox, mesh_set)
+
+def classify_eye_state_on_roi(frame_bgr, bbox, mesh=_NO_MESH, key=None, state=None, now=None):
+    if mesh is _NO_MESH:
+        mesh = _cached_mesh(frame_bgr, bbox, key)
+    if mesh is None:
+        return "open", 1.0
+
+    left_pts = mesh[LEFT_EYE_IDX]
+    right_pts = mesh[RIGHT_EYE_IDX]
     ear = (_eye_aspect_ratio(left_pts) + _eye_aspect_ratio(right_pts)) / 2.0
 
-    key = _face_key_from_bbox(bbox)
-    now = time.time()
+    now = time.time() if now is None else now
+    if state is None:
+        state = _default_state.touch(key or _face_key_from_bbox(bbox), now)
     if ear < EAR_THRESHOLD:
-        if key not in _last_eye_open_time:
-            _last_eye_open_time[key] = now
-        elapsed = now - _last_eye_open_time[key]
+        elapsed = now - state.eyes_open_at
         return ("sleeping" if elapsed >= SLEEP_SECONDS else "closed", ear)
     else:
-        _last_eye_open_time[key] = now
+        state.eyes_open_at = now
         return "open", ear
 
 MODEL_POINTS = np.array([
@@ -125,42 +325,54 @@ def classify_head_pose(landmarks, frame_shape):
     yaw = float(euler[1])
     return ("away" if abs(yaw) > YAW_THRESHOLD else "forward", yaw)
 
-def classify_mouth_state(frame_bgr, bbox):
-    x1,y1,x2,y2 = bbox
-    roi = frame_bgr[y1:y2, x1:x2]
-    if roi.size == 0:
-        return "closed", 0.0
-
-    rgb = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
-    res = _face_mesh.process(rgb)
-    if not res.multi_face_landmarks:
+def classify_mouth_state(frame_bgr, bbox, mesh=_NO_MESH, key=None):
+    if mesh is _NO_MESH:
+        mesh = _cached_mesh(frame_bgr, bbox, key)
+    if mesh is None:
         return "closed", 0.0
 
-    lm = res.multi_face_landmarks[0].landmark
-    rh,rw = roi.shape[:2]
-    pts = np.array([[lm[i].x * rw, lm[i].y * rh] for i in MOUTH_IDX], dtype=np.float32)
+    pts = mesh[MOUTH_IDX]
     mar = _mouth_aspect_ratio([pts[0], pts[3], pts[4], pts[5]])
     return ("talking" if mar > MAR_THRESHOLD else "closed", mar)
 
-def classify_behavior(frame, bbox, landmarks, has_phone=False, student_key=""):
-    now = time.time()
-    if student_key:
-        _last_seen_time[student_key] = now
+def analyze_face(frame, bbox, landmarks, has_phone=False, student_key="", mesh=_NO_MESH, key=None,
+                 store=None, now=None):
+    """Single FaceMesh pass per face; returns the labels and the raw EAR/MAR/yaw.
 
-    if student_key in _last_seen_time:
-        if now - _last_seen_time[student_key] > ABSENT_SECONDS:
-            return "absent"
+    `now` is the frame time (video time for recorded lessons), default wall clock.
+    """
+    now = time.time() if now is None else now
+    key = key or student_key or _face_key_from_bbox(bbox)
+    store = _default_state if store is None else store
+    state = store.touch(key, now)
 
-    eye_state, _ = classify_eye_state_on_roi(frame, bbox)
-    if eye_state in ("sleeping", "closed"):
-        return "sleeping"
+    if mesh is _NO_MESH:
+        mesh = _cached_mesh(frame, bbox, key, store.meshes)
+    eye_state, ear = classify_eye_state_on_roi(frame, bbox, mesh, key, state, now)
+    mouth_state, mar = classify_mouth_state(frame, bbox, mesh, key)
+    head_state, yaw = classify_head_pose(landmarks, frame.shape)
 
-    mouth_state, _ = classify_mouth_state(frame, bbox)
-    if mouth_state == "talking":
-        return "talking"
+    if eye_state in ("sleeping", "closed"):
+        behavior = "sleeping"
+    elif mouth_state == "talking":
+        behavior = "talking"
+    elif head_state == "away" or has_phone:
+        behavior = "distracted"
+    else:
+        behavior = "attentive"
+    return FaceAnalysis(behavior, eye_state, ear, mouth_state, mar, head_state, yaw)
 
-    head_state, _ = classify_head_pose(landmarks, frame.shape)
-    if head_state == "away" or has_phone:
-        return "distracted"
+def analyze_faces(frame, faces, keys=None, store=None, now=None):
+    """Batched version of analyze_face for all detections of one frame."""
+    keys = keys or [face_key(f) for f in faces]
+    store = _default_state if store is None else store
+    now = time.time() if now is None else now
+    store.evict(now)
+    meshes = mesh_faces(frame, [f["bbox"] for f in faces], keys, store.meshes)
+    return [
+        analyze_face(frame, f["bbox"], f.get("landmarks", []), mesh=m, key=k, store=store, now=now)
+        for f, m, k in zip(faces, meshes, keys)
+    ]
 
-    return "attentive"
+def classify_behavior(frame, bbox, landmarks, has_phone=False, student_key=""):
+    return analyze_face(frame, bbox, landmarks, has_phone, student_key).behavior
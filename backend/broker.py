@@ -0,0 +1,123 @@
+import threading
+
+# keep a producer alive briefly after its last viewer leaves (browser reloads)
+LINGER_SECONDS = 3.0
+
+
+class CameraInUse(Exception):
+    def __init__(self, session_id):
+        super().__init__(f"camera in use by session {session_id}")
+        self.session_id = session_id
+
+
+class CameraBroker:
+    """One StreamPipeline per camera, shared by every viewer of that camera.
+
+    Producers are reference-counted: each /detect/stream response holds a
+    subscription, and the pipeline (capture + inference) stops when the last
+    one is released or when its session is stopped.
+    """
+
+    def __init__(self, linger=LINGER_SECONDS):
+        self.linger = linger
+        self._lock = threading.Lock()
+        self._producers = {}  # source -> _Producer
+
+    def subscribe(self, source, session_id, factory):
+        """Join the producer for `source`, creating it with factory() if needed.
+
+        The source is reserved under the lock but factory() (camera open,
+        model setup) runs outside it, so other cameras are not held up;
+        viewers of the same camera wait for the first one to publish it.
+        """
+        while True:
+            with self._lock:
+                p = self._producers.get(source)
+                if p is not None and p.pipeline is not None and p.pipeline.stopped:
+                    self._producers.pop(source)
+                    p = None
+                if p is None:
+                    p = self._producers[source] = _Producer(source, session_id)
+                    break
+                if p.session_id != session_id:
+                    raise CameraInUse(p.session_id)
+                if p.pipeline is not None:
+                    return self._join(p)
+            p.ready.wait()  # being built by another viewer; it may also fail
+
+        try:
+            pipeline = factory().start()
+        except BaseException:
+            with self._lock:
+                if self._producers.get(source) is p:
+                    self._producers.pop(source)
+            p.ready.set()
+            raise
+        with self._lock:
+            p.pipeline = pipeline
+            published = self._producers.get(source) is p
+            if published:
+                self._join(p)
+        p.ready.set()
+        if not published:
+            pipeline.stop()  # session stopped while the camera was opening
+        return pipeline
+
+    def _join(self, p):
+        if p.linger_timer is not None:
+            p.linger_timer.cancel()
+            p.linger_timer = None
+        p.subscribers += 1
+        return p.pipeline
+
+    def release(self, source, pipeline):
+        with self._lock:
+            p = self._producers.get(source)
+            if p is None or p.pipeline is not pipeline:
+                return
+            p.subscribers -= 1
+            if p.subscribers > 0:
+                return
+            if self.linger <= 0 or pipeline.stopped:
+                self._producers.pop(source)
+            else:
+                p.linger_timer = threading.Timer(self.linger, self._expire, (source, pipeline))
+                p.linger_timer.daemon = True
+                p.linger_timer.start()
+                return
+        pipeline.stop()
+
+    def _expire(self, source, pipeline):
+        with self._lock:
+            p = self._producers.get(source)
+            if p is None or p.pipeline is not pipeline or p.subscribers > 0:
+                return
+            self._producers.pop(source)
+        pipeline.stop()
+
+    def stop_session(self, session_id):
+        with self._lock:
+            stopping = [s for s, p in self._producers.items() if p.session_id == session_id]
+            producers = [self._producers.pop(s) for s in stopping]
+        for p in producers:
+            if p.linger_timer is not None:
+                p.linger_timer.cancel()
+            if p.pipeline is not None:  # still being built: subscribe() stops it
+                p.pipeline.stop()
+        return len(producers)
+
+    def active(self):
+        with self._lock:
+            return {s: (p.session_id, p.subscribers) for s, p in self._producers.items()}
+
+
+class _Producer:
+    __slots__ = ("source", "session_id", "pipeline", "ready", "subscribers", "linger_timer")
+
+    def __init__(self, source, session_id):
+        self.source = source
+        self.session_id = session_id
+        self.pipeline = None  # set once factory() returns, see CameraBroker.subscribe
+        self.ready = threading.Event()
+        self.subscribers = 0
+        self.linger_timer = None
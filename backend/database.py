@@ -0,0 +1,28 @@
+import os
+from sqlalchemy import create_engine, event
+
+DB_URL = os.getenv("SANAD_DB_URL", "sqlite:///db.sqlite3")
+
+# production profile for the single-file SQLite DB: WAL lets the stream
+# writer and the API readers work concurrently, NORMAL sync is durable
+# enough under WAL, and a larger cache/mmap keeps hot pages in memory
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SANAD_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SANAD_SQLITE_CACHE_KB", "65536")),
+    "mmap_size": int(os.getenv("SANAD_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+
+def make_engine(url=DB_URL, **kw):
+    engine = create_engine(url, echo=False, future=True, **kw)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_conn, _record):
+            cur = dbapi_conn.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cur.execute(f"PRAGMA {name}={value}")
+            cur.close()
+    return engine
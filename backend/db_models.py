@@ -2,9 +2,9 @@ import os
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, Boolean, Text, Float,
-    DateTime, ForeignKey
+    DateTime, ForeignKey, LargeBinary, Index
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, deferred
 
 Base = declarative_base()
 
@@ -39,13 +39,16 @@ class Student(Base):
 
     id = Column(Integer, primary_key=True)
     full_name = Column(String(160), nullable=False)
-    class_name = Column(String(64))
+    class_name = Column(String(64), index=True)
     photo_path = Column(String(255))
-    embedding = Column(Text)
-    parent_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    embedding = deferred(Column(Text))  # legacy CSV, emptied by backend.migrate
+    embedding_blob = deferred(Column(LargeBinary))  # see helpers.pack_embedding
+    embedding_model = Column(String(32))  # provider name, see helpers.get_embedding_provider
+    parent_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
 
     parent = relationship("User", back_populates="students")
     behaviors = relationship("Behavior", back_populates="student", cascade="all, delete-orphan")
+    summaries = relationship("BehaviorSummary", cascade="all, delete-orphan")
 
     def to_dict(self, include_behaviors=False):
         data = {
@@ -75,10 +78,11 @@ class Session(Base):
     __tablename__ = "sessions"
 
     id = Column(Integer, primary_key=True)
-    teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime, nullable=True)
     is_exam = Column(Boolean, nullable=False, default=False)
+    class_name = Column(String(64), nullable=True)  # roster used for absentees
     active = Column(Boolean, default=True)
 
     teacher = relationship("User", back_populates="sessions")
@@ -97,3 +101,21 @@ class Behavior(Base):
 
     session = relationship("Session", back_populates="behaviors")
     student = relationship("Student", back_populates="behaviors")
+
+    # see alembic revision 0002
+    __table_args__ = (
+        Index("ix_behaviors_session_student", "session_id", "student_id"),
+        Index("ix_behaviors_student_timestamp", "student_id", "timestamp"),
+    )
+
+
+class BehaviorSummary(Base):
+    """Per (session, student, behavior) event counts, kept by backend.summaries."""
+    __tablename__ = "behavior_summaries"
+
+    session_id = Column(Integer, ForeignKey("sessions.id"), primary_key=True)
+    student_id = Column(Integer, ForeignKey("students.id"), primary_key=True, index=True)
+    behavior = Column(String(32), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
@@ -1,4 +1,4 @@
-import os, sys, cv2, torch
+import os, sys, cv2
 import numpy as np
 
 # yolov5-face repo path and weight file at project root
@@ -9,67 +9,174 @@ if Y5_FACE_DIR not in sys.path:
 
 WEIGHTS = os.path.join(ROOT, "yolov5m-face.pt")
 
-from models.experimental import attempt_load
-from utils.general import non_max_suppression_face
-from backend.behavior import (
-    classify_behavior, classify_eye_state_on_roi,
-    classify_mouth_state, classify_head_pose
-)
+from backend.behavior import analyze_face, face_key
+
+# torch and yolov5-face are imported by the first FaceDetector, so modules that
+# only need draw_boxes/letterbox_params (API workers, the encoder) skip them
+torch = attempt_load = non_max_suppression_face = None
+
+
+def _import_torch():
+    global torch, attempt_load, non_max_suppression_face
+    if torch is None:
+        import torch as _torch
+        from models.experimental import attempt_load
+        from utils.general import non_max_suppression_face
+        torch = _torch
+
+# inference backend: "torch" (eager), "torchscript" or "onnx" (ONNX Runtime CPU)
+DETECTOR_BACKEND = os.getenv("SANAD_DETECTOR_BACKEND", "torch")
+# torch backends only: fp32, bf16 (CPU autocast) or fp16 (CUDA)
+DETECTOR_PRECISION = os.getenv("SANAD_DETECTOR_PRECISION", "fp32")
+# exported model for the torchscript/onnx backends
+DETECTOR_EXPORT = os.getenv("SANAD_DETECTOR_EXPORT", "")
+LETTERBOX_COLOR = 114
+
+
+def letterbox_params(h, w, size):
+    """Scale and padding that fit an h x w frame into a size x size square."""
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    return r, nw, nh, (size - nw) // 2, (size - nh) // 2
+
 
 class FaceDetector:
-    def __init__(self, weights=WEIGHTS, img_size=640, conf_thres=0.25, iou_thres=0.45):
+    def __init__(self, weights=WEIGHTS, img_size=640, conf_thres=0.25, iou_thres=0.45,
+                 backend=None, precision=None, export_path=None):
+        _import_torch()
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        self.model = attempt_load(weights, map_location=self.device)  # yolov5-face
-        self.model.eval()
+        self.backend = backend or DETECTOR_BACKEND
+        self.precision = precision or DETECTOR_PRECISION
         self.img_size = img_size
         self.conf_thres = conf_thres
         self.iou_thres = iou_thres
+        self.model = None
+        self.session = None
+        self._buffers = {}  # (batch, size) -> staging buffers, reused across calls
+
+        export_path = export_path or DETECTOR_EXPORT
+        if self.backend == "onnx":
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise RuntimeError("onnxruntime is required for SANAD_DETECTOR_BACKEND=onnx")
+            self.session = ort.InferenceSession(export_path, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+        elif self.backend == "torchscript":
+            self.model = torch.jit.load(export_path, map_location=self.device)
+        else:
+            self.model = attempt_load(weights, map_location=self.device)  # yolov5-face
+
+        if self.model is not None:
+            self.model.eval()
+            self.model = self.model.to(memory_format=torch.channels_last)
+            if self.precision == "fp16" and self.device.type == "cuda":
+                self.model = self.model.half()
+
+    # ---- preprocessing -------------------------------------------------------
+
+    def _get_buffers(self, batch, size):
+        key = (batch, size)
+        if key not in self._buffers:
+            pin = self.device.type == "cuda"
+            # uint8 NHWC staging image; its NCHW view is already channels_last
+            staging = torch.full((batch, size, size, 3), LETTERBOX_COLOR, dtype=torch.uint8)
+            if pin:
+                staging = staging.pin_memory()
+            if self.session is not None:
+                inp = np.empty((batch, 3, size, size), dtype=np.float32)
+            else:
+                dtype = torch.float16 if self.precision == "fp16" and pin else torch.float32
+                inp = torch.empty((batch, 3, size, size), dtype=dtype, device=self.device,
+                                  memory_format=torch.channels_last)
+            self._buffers[key] = {"staging": staging, "input": inp, "shapes": [None] * batch}
+        return self._buffers[key]
+
+    def _letterbox_into(self, buf, i, bgr, size):
+        h, w = bgr.shape[:2]
+        r, nw, nh, px, py = letterbox_params(h, w, size)
+        dst = buf["staging"][i].numpy()
+        if buf["shapes"][i] != (h, w):
+            dst[...] = LETTERBOX_COLOR  # padding only moves when the frame size does
+            buf["shapes"][i] = (h, w)
+        resized = cv2.resize(bgr, (nw, nh), interpolation=cv2.INTER_LINEAR)
+        dst[py:py + nh, px:px + nw] = resized[:, :, ::-1]  # BGR -> RGB
+        return r, px, py, w, h
+
+    # ---- inference -----------------------------------------------------------
+
+    def _forward(self, buf, n):
+        staging = buf["staging"][:n]
+        if self.session is not None:
+            inp = buf["input"][:n]
+            np.multiply(staging.numpy().transpose(0, 3, 1, 2), 1.0 / 255.0, out=inp, casting="unsafe")
+            return torch.from_numpy(self.session.run(None, {self.input_name: inp})[0])
+
+        inp = buf["input"][:n]
+        inp.copy_(staging.permute(0, 3, 1, 2), non_blocking=True)
+        inp.mul_(1.0 / 255.0)
+        with torch.inference_mode():
+            if self.precision == "bf16" and self.device.type == "cpu":
+                with torch.autocast("cpu", dtype=torch.bfloat16):
+                    pred = self.model(inp)[0]
+                return pred.float()
+            return self.model(inp)[0].float()
+
+    def predict_batch(self, frames, img_size=None):
+        """Detect faces in several BGR frames with one forward pass.
+
+        Returns one list per frame of {"bbox", "conf", "landmarks"} in that
+        frame's own pixel coordinates.
+        """
+        if not frames:
+            return []
+        size = img_size or self.img_size
+        buf = self._get_buffers(len(frames), size)
+        geoms = [self._letterbox_into(buf, i, f, size) for i, f in enumerate(frames)]
 
-    def predict(self, bgr):
-        im = cv2.resize(bgr, (self.img_size, self.img_size))
-        im_rgb = im[:, :, ::-1].transpose(2, 0, 1)
-        im_rgb = np.ascontiguousarray(im_rgb)
-        im_tensor = torch.from_numpy(im_rgb).to(self.device).float() / 255.0
-        if im_tensor.ndimension() == 3:
-            im_tensor = im_tensor.unsqueeze(0)
+        pred = self._forward(buf, len(frames))
+        dets = non_max_suppression_face(pred, conf_thres=self.conf_thres, iou_thres=self.iou_thres)
+        return [self._to_results(d, g) for d, g in zip(dets, geoms)]
 
-        pred = self.model(im_tensor, augment=False)[0]
-        det = non_max_suppression_face(pred, conf_thres=self.conf_thres, iou_thres=self.iou_thres)[0]
+    def predict(self, bgr, img_size=None):
+        return self.predict_batch([bgr], img_size)[0]
 
+    @staticmethod
+    def _to_results(det, geom):
+        r, px, py, w, h = geom
         results = []
-        if det is not None and len(det):
-            det = det.cpu().numpy()
-            for d in det:
-                x1, y1, x2, y2 = d[0:4]
-                conf = d[4]
-                # yolov5-face can output landmarks at indices 5..14 (optional per build)
-                landmarks = []
-                if d.shape[0] >= 15:
-                    # x5,y5 pairs
-                    landmarks = [
-                        (float(d[5]), float(d[6])),
-                        (float(d[7]), float(d[8])),
-                        (float(d[9]), float(d[10])),
-                        (float(d[11]), float(d[12])),
-                        (float(d[13]), float(d[14])),
-                    ]
-                results.append({
-                    "bbox": [int(x1), int(y1), int(x2), int(y2)],
-                    "conf": float(conf),
-                    "landmarks": landmarks
-                })
+        if det is None or not len(det):
+            return results
+        det = det.cpu().numpy()
+        for d in det:
+            x1, x2 = [min(max((v - px) / r, 0), w - 1) for v in (d[0], d[2])]
+            y1, y2 = [min(max((v - py) / r, 0), h - 1) for v in (d[1], d[3])]
+            conf = d[4]
+            # yolov5-face can output landmarks at indices 5..14 (optional per build)
+            landmarks = []
+            if d.shape[0] >= 15:
+                # x5,y5 pairs, mapped back out of the letterbox
+                landmarks = [
+                    (float((d[k] - px) / r), float((d[k + 1] - py) / r))
+                    for k in (5, 7, 9, 11, 13)
+                ]
+            results.append({
+                "bbox": [int(x1), int(y1), int(x2), int(y2)],
+                "conf": float(conf),
+                "landmarks": landmarks
+            })
         return results
 
-def draw_boxes(img, faces, labels=None):
+def draw_boxes(img, faces, labels=None, analyses=None):
     for i, f in enumerate(faces):
         x1, y1, x2, y2 = f["bbox"]
         bbox = f["bbox"]
         landmarks = f.get("landmarks", [])
 
-        behavior = classify_behavior(img, bbox, landmarks, has_phone=False, student_key=str(i))
-        eye_state, ear = classify_eye_state_on_roi(img, bbox)
-        mouth_state, mar = classify_mouth_state(img, bbox)
-        head_state, yaw = classify_head_pose(landmarks, img.shape)
+        a = analyses[i] if analyses and i < len(analyses) else None
+        if a is None:
+            a = analyze_face(img, bbox, landmarks, has_phone=False, key=face_key(f))
+        behavior, ear, mar, yaw = a.behavior, a.ear, a.mar, a.yaw
 
         cv2.rectangle(img, (x1, y1), (x2, y2), (0,255,0), 2)
 
@@ -0,0 +1,182 @@
+import os, threading
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple
+
+from backend.db_models import Student
+from backend.helpers import (
+    parse_embedding, pack_embedding, get_embedding_provider, LEGACY_EMBEDDING_MODEL
+)
+
+
+class FaceGallery:
+    """Process-wide, pre-normalized matrix of student embeddings.
+
+    Loaded lazily on the first match and kept in sync by the student CRUD
+    endpoints, so the frame loop never touches the DB to identify faces and
+    API-only workers never hold the matrix. Rows stored by another provider
+    are converted once at startup (reembed_stale), not by the lazy load. The
+    embedding provider is also built on first use unless one is passed in.
+    """
+
+    def __init__(self, session_factory=None, provider=None):
+        self.session_factory = session_factory
+        self._provider = provider
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._ids: List[int] = []
+        self._names: List[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            with self._lock:
+                if self._provider is None:
+                    self._provider = get_embedding_provider()
+        return self._provider
+
+    # ---- loading / invalidation ----------------------------------------------
+
+    def load(self, db):
+        """(Re)build the matrix. Rows embedded by another provider are left
+        out; reembed_stale() at startup converts them, so this never writes."""
+        rows = db.query(
+            Student.id, Student.full_name, Student.embedding_model,
+            Student.embedding_blob, Student.embedding
+        ).all()
+        ids, names, vecs = [], [], []
+        for sid, name, model, blob, txt in rows:
+            if (model or LEGACY_EMBEDDING_MODEL) != self.provider.name:
+                continue
+            vec = parse_embedding(blob if blob is not None else txt)
+            if vec is None:
+                continue
+            ids.append(sid); names.append(name); vecs.append(vec)
+
+        with self._lock:
+            self._set(ids, names, vecs)
+            self._loaded = True
+
+    def reembed_stale(self, db):
+        """Re-embed students stored by another provider; returns how many.
+        Run once at startup (main.bootstrap); the matrix is not loaded."""
+        stale = [
+            sid for sid, model in db.query(Student.id, Student.embedding_model)
+            if (model or LEGACY_EMBEDDING_MODEL) != self.provider.name
+        ]
+        if not stale:
+            return 0
+        done = self.reembed(db, stale)
+        self.invalidate()
+        return len(done)
+
+    def reembed(self, db, student_ids, batch=32):
+        """Re-embed students from their stored photos with the active provider."""
+        done = []
+        for start in range(0, len(student_ids), batch):
+            studs = db.query(Student).filter(Student.id.in_(student_ids[start:start + batch])).all()
+            faces, owners = [], []
+            for s in studs:
+                img = cv2.imread(s.photo_path) if s.photo_path and os.path.exists(s.photo_path) else None
+                if img is None:
+                    continue
+                faces.append(cv2.resize(img, (112, 112)))
+                owners.append(s)
+            for s, vec in zip(owners, self.provider.embed_many(faces)):
+                s.embedding_blob = pack_embedding(vec)
+                s.embedding_model = self.provider.name
+                s.embedding = None
+                done.append((s.id, s.full_name, vec))
+            db.commit()
+        return done
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded or self.session_factory is None:
+            return
+        db = self.session_factory()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def _set(self, ids, names, vecs):
+        # keep only the dominant dimension so one matmul covers everyone
+        if vecs:
+            dims = [v.shape[0] for v in vecs]
+            dim = max(set(dims), key=dims.count)
+            keep = [i for i, d in enumerate(dims) if d == dim]
+            ids = [ids[i] for i in keep]
+            names = [names[i] for i in keep]
+            mat = np.stack([vecs[i] for i in keep]).astype(np.float32)
+            mat /= (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-8)
+        else:
+            mat = np.zeros((0, 0), dtype=np.float32)
+        self._ids, self._names, self._matrix = list(ids), list(names), mat
+
+    def upsert(self, student_id: int, name: str, embedding):
+        vec = parse_embedding(embedding)
+        with self._lock:
+            if not self._loaded:
+                return
+            ids, names = list(self._ids), list(self._names)
+            vecs = list(self._matrix)
+            if student_id in ids:
+                i = ids.index(student_id)
+                del ids[i], names[i], vecs[i]
+            if vec is not None:
+                ids.append(student_id); names.append(name); vecs.append(vec)
+            self._set(ids, names, vecs)
+
+    def remove(self, student_id: int):
+        with self._lock:
+            if not self._loaded or student_id not in self._ids:
+                return
+            i = self._ids.index(student_id)
+            keep = [j for j in range(len(self._ids)) if j != i]
+            self._ids = [self._ids[j] for j in keep]
+            self._names = [self._names[j] for j in keep]
+            self._matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    # ---- matching ------------------------------------------------------------
+
+    def match(self, embeddings) -> List[Tuple[Optional[int], str, float, float]]:
+        """Return (student_id, name, best_sim, second_sim) for every embedding."""
+        self._ensure_loaded()
+        with self._lock:
+            ids, names, mat = self._ids, self._names, self._matrix
+        n = len(embeddings)
+        if n == 0:
+            return []
+        if not ids:
+            return [(None, "unknown", -1.0, -1.0)] * n
+
+        q = np.stack([np.asarray(e, dtype=np.float32).ravel() for e in embeddings])
+        if q.shape[1] != mat.shape[1]:
+            return [(None, "unknown", -1.0, -1.0)] * n
+        q /= (np.linalg.norm(q, axis=1, keepdims=True) + 1e-8)
+        sims = q @ mat.T  # (faces, students)
+
+        if sims.shape[1] == 1:
+            best_idx = np.zeros(n, dtype=np.int64)
+            best = sims[:, 0]
+            second = np.full(n, -1.0, dtype=np.float32)
+        else:
+            top2 = np.argpartition(-sims, 1, axis=1)[:, :2]
+            top2_sims = np.take_along_axis(sims, top2, axis=1)
+            order = np.argsort(-top2_sims, axis=1)
+            top2 = np.take_along_axis(top2, order, axis=1)
+            top2_sims = np.take_along_axis(top2_sims, order, axis=1)
+            best_idx, best, second = top2[:, 0], top2_sims[:, 0], top2_sims[:, 1]
+
+        return [
+            (ids[j], names[j], float(b), float(s))
+            for j, b, s in zip(best_idx, best, second)
+        ]
@@ -1,6 +1,15 @@
+import importlib.util, os, struct, threading
+from abc import ABC, abstractmethod
 import cv2
 import numpy as np
 
+# binary embedding layout: magic, version, dtype code, dim, then raw values
+EMB_MAGIC = b"SE"
+EMB_VERSION = 1
+EMB_HEADER = struct.Struct("<2sBBI")
+_EMB_DTYPES = {0: np.float32, 1: np.float16}
+EMBEDDING_DTYPE = np.float16
+
 def preprocess_face(img, bbox, size=112):
     x1, y1, x2, y2 = [int(v) for v in bbox]
     x1 = max(0, x1); y1 = max(0, y1)
@@ -9,11 +18,207 @@ def preprocess_face(img, bbox, size=112):
         return None
     return cv2.resize(face, (size, size))
 
+def appearance_signature(img, bbox, size=12):
+    """Zero-mean, unit-norm gray thumbnail of a face; the dot product of two
+    signatures is their correlation (see IdentityCache.check_appearance)."""
+    face = preprocess_face(img, bbox, size)
+    if face is None:
+        return None
+    vec = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY).astype(np.float32).ravel()
+    vec -= vec.mean()
+    return vec / (np.linalg.norm(vec) + 1e-8)
+
 def simple_embedding(face):
     vec = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
     return vec.flatten()
 
+# ---- Embedding providers -----------------------------------------------------
+
+class EmbeddingProvider(ABC):
+    """Face crop -> fixed-size vector; `name` is stored with each embedding."""
+    name = "base"
+    dim = 0
+    # FrameAnalyzer's accept test (best sim, best - second best); similarity
+    # scales differ per embedding space, so every provider carries its own
+    min_sim = 0.8
+    min_margin = 0.05
+
+    def embed(self, face):
+        return self.embed_many([face])[0]
+
+    @abstractmethod
+    def embed_many(self, crops):
+        """(len(crops), dim) float32 array, one row per BGR face crop."""
+
+
+class RawPixelEmbedding(EmbeddingProvider):
+    """Original 112x112 grayscale pixels; kept so old galleries still match."""
+    name = "raw112"
+    dim = 112 * 112
+    min_sim = 0.8
+    min_margin = 0.05
+
+    def embed(self, face):
+        return simple_embedding(face)
+
+    def embed_many(self, crops):
+        if not crops:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([simple_embedding(c) for c in crops])
+
+
+def _lbp_riu2_table():
+    # rotation-invariant uniform LBP: popcount for <=2 transitions, else 9
+    table = np.zeros(256, dtype=np.uint8)
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        transitions = sum(bits[i] != bits[(i + 1) % 8] for i in range(8))
+        table[code] = sum(bits) if transitions <= 2 else 9
+    return table
+
+
+class LBPEmbedding(EmbeddingProvider):
+    """Grid of LBP histograms: 7x7 cells x 10 riu2 bins = 490 dims, CPU only."""
+    name = "lbp490"
+    grid = 7
+    bins = 10
+    dim = grid * grid * bins
+    size = 112
+    # cosines of non-negative histograms run high for any two faces: a higher
+    # bar, a smaller margin; not calibrated on real data, tune with SANAD_MIN_*
+    min_sim = 0.9
+    min_margin = 0.02
+    _table = _lbp_riu2_table()
+
+    def embed_many(self, crops):
+        if not crops:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        gray = np.stack([
+            cv2.equalizeHist(cv2.cvtColor(cv2.resize(c, (self.size, self.size)), cv2.COLOR_BGR2GRAY))
+            for c in crops
+        ]).astype(np.int16)
+        n, h, w = gray.shape
+        pad = np.pad(gray, ((0, 0), (1, 1), (1, 1)), mode="edge")
+        codes = np.zeros((n, h, w), dtype=np.uint8)
+        offsets = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+        for bit, (dy, dx) in enumerate(offsets):
+            nb = pad[:, 1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+            codes |= (nb >= gray).astype(np.uint8) << bit
+        codes = self._table[codes]
+
+        cell = h // self.grid
+        rows = np.minimum(np.arange(h) // cell, self.grid - 1)
+        cols = np.minimum(np.arange(w) // cell, self.grid - 1)
+        cell_idx = (rows[:, None] * self.grid + cols[None, :]).astype(np.int64)
+        idx = (np.arange(n)[:, None, None] * self.dim
+               + cell_idx[None] * self.bins + codes)
+        hist = np.bincount(idx.ravel(), minlength=n * self.dim).reshape(n, self.dim)
+        # Hellinger mapping makes cosine similarity behave on histograms
+        return np.sqrt(hist.astype(np.float32) / float(cell * cell))
+
+
+class OnnxEmbedding(EmbeddingProvider):
+    """Face recognition model exported to ONNX (e.g. a 128/512-d ArcFace)."""
+    size = 112
+    min_sim = 0.4
+    min_margin = 0.05
+
+    def __init__(self, path):
+        if importlib.util.find_spec("onnxruntime") is None:
+            raise RuntimeError("onnxruntime is required for ONNX embeddings")
+        if not os.path.exists(path):
+            raise RuntimeError(f"embedding model not found: {path}")
+        self.path = path
+        self.name = ("onnx-" + os.path.splitext(os.path.basename(path))[0])[:32]
+        self.dim = 0
+        self.session = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # the session is opened on the first embedding, not in every worker
+        # that merely imports the app or checks self.name
+        with self._lock:
+            if self.session is None:
+                import onnxruntime as ort
+                session = ort.InferenceSession(self.path, providers=["CPUExecutionProvider"])
+                self.input_name = session.get_inputs()[0].name
+                out_shape = session.get_outputs()[0].shape
+                self.dim = out_shape[-1] if isinstance(out_shape[-1], int) else 0
+                self.session = session
+        return self.session
+
+    def embed_many(self, crops):
+        if not crops:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        batch = np.stack([
+            cv2.cvtColor(cv2.resize(c, (self.size, self.size)), cv2.COLOR_BGR2RGB)
+            for c in crops
+        ]).astype(np.float32)
+        batch = ((batch - 127.5) / 128.0).transpose(0, 3, 1, 2)
+        out = self._load().run(None, {self.input_name: np.ascontiguousarray(batch)})[0]
+        return out.reshape(len(crops), -1).astype(np.float32)
+
+
+EMBEDDING_PROVIDERS = {
+    RawPixelEmbedding.name: RawPixelEmbedding,
+    LBPEmbedding.name: LBPEmbedding,
+}
+LEGACY_EMBEDDING_MODEL = RawPixelEmbedding.name
+
+
+def get_embedding_provider(spec=None):
+    """Build a provider from SANAD_EMBEDDER: "raw112" (default), "lbp490" or "onnx:<path>".
+
+    SANAD_MIN_SIM / SANAD_MIN_MARGIN override the provider's accept thresholds.
+    """
+    spec = spec or os.getenv("SANAD_EMBEDDER", RawPixelEmbedding.name)
+    if spec.startswith("onnx:"):
+        provider = OnnxEmbedding(spec[len("onnx:"):])
+    elif spec in EMBEDDING_PROVIDERS:
+        provider = EMBEDDING_PROVIDERS[spec]()
+    else:
+        raise RuntimeError(f"unknown embedding provider: {spec}")
+    if os.getenv("SANAD_MIN_SIM"):
+        provider.min_sim = float(os.environ["SANAD_MIN_SIM"])
+    if os.getenv("SANAD_MIN_MARGIN"):
+        provider.min_margin = float(os.environ["SANAD_MIN_MARGIN"])
+    return provider
+
 def cosine_similarity(a, b):
     a = a.astype(np.float32); b = b.astype(np.float32)
     denom = (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8)
     return float(np.dot(a, b) / denom)
+
+def pack_embedding(vec, dtype=EMBEDDING_DTYPE):
+    vec = np.asarray(vec).ravel().astype(dtype)
+    code = 1 if vec.dtype == np.float16 else 0
+    return EMB_HEADER.pack(EMB_MAGIC, EMB_VERSION, code, vec.shape[0]) + vec.tobytes()
+
+def unpack_embedding(blob):
+    if not blob or len(blob) < EMB_HEADER.size:
+        return None
+    magic, version, code, dim = EMB_HEADER.unpack_from(blob)
+    if magic != EMB_MAGIC or version != EMB_VERSION or code not in _EMB_DTYPES:
+        return None
+    vec = np.frombuffer(blob, dtype=_EMB_DTYPES[code], count=dim, offset=EMB_HEADER.size)
+    return vec.astype(np.float32)
+
+def parse_embedding(raw):
+    if raw is None:
+        return None
+    if isinstance(raw, np.ndarray):
+        return raw.astype(np.float32).ravel()
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        return unpack_embedding(bytes(raw))
+    txt = raw.strip()
+    if txt.startswith("[") and txt.endswith("]"):
+        txt = txt[1:-1]
+    if not txt:
+        return None
+    try:
+        return np.array(
+            [float(x) for x in txt.replace("\n", " ").split(",")],
+            dtype=np.float32
+        )
+    except Exception:
+        return None
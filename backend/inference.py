@@ -0,0 +1,137 @@
+import os, threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+from backend import profiler
+
+DETECTOR_WORKERS = int(os.getenv("SANAD_DETECTOR_WORKERS", "1"))
+MAX_BATCH = int(os.getenv("SANAD_DETECTOR_MAX_BATCH", "4"))
+
+
+class InferencePool:
+    """Shared detector workers for every active classroom stream.
+
+    Each room queues frames under its own key. Workers build batches
+    round-robin, taking at most one frame per room per pass, so one busy
+    camera cannot starve the others. Frames with the same input size from
+    different rooms go through FaceDetector.predict_batch together.
+    """
+
+    def __init__(self, detector_factory, workers=DETECTOR_WORKERS, max_batch=MAX_BATCH):
+        self.max_batch = max(1, max_batch)
+        self._cond = threading.Condition()
+        self._rooms = OrderedDict()  # room -> deque[(frame, img_size, Future)]
+        self._closed = False
+        self._threads = []
+        self.batches = 0
+        self.frames = 0
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, args=(detector_factory(),),
+                                 name=f"detector-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, room, frame, img_size=None) -> Future:
+        fut = Future()
+        with self._cond:
+            if self._closed:
+                fut.set_exception(RuntimeError("inference pool closed"))
+                return fut
+            self._rooms.setdefault(room, deque()).append((frame, img_size, fut, room))
+            self._cond.notify()
+        return fut
+
+    def detector_for(self, room):
+        return PooledDetector(self, room)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _next_batch(self):
+        batch, size = [], None
+        while len(batch) < self.max_batch:
+            took = False
+            for room in list(self._rooms):
+                q = self._rooms[room]
+                if q and (size is None or q[0][1] == size) and len(batch) < self.max_batch:
+                    item = q.popleft()
+                    size = item[1]
+                    batch.append(item)
+                    took = True
+                    # rotate so the next batch starts with the following room
+                    self._rooms.move_to_end(room)
+                if not q:
+                    self._rooms.pop(room, None)
+            if not took:
+                break
+        return batch, size
+
+    def _worker(self, detector):
+        while True:
+            with self._cond:
+                while not self._rooms and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._rooms:
+                    return
+                batch, size = self._next_batch()
+            if not batch:
+                continue
+            try:
+                with profiler.batch([b[3] for b in batch]):
+                    results = detector.predict_batch([b[0] for b in batch], img_size=size)
+            except Exception as e:
+                for _, _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.frames += len(batch)
+            for (_, _, fut, _), res in zip(batch, results):
+                fut.set_result(res)
+
+
+class PooledDetector:
+    """FaceDetector look-alike for one room, backed by the shared pool."""
+
+    def __init__(self, pool, room):
+        self.pool = pool
+        self.room = room
+
+    def predict(self, bgr, img_size=None):
+        return self.pool.submit(self.room, bgr, img_size).result()
+
+
+def parse_source(value):
+    """Camera source: a device index, an RTSP/HTTP URL or a video file path."""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    return int(value) if value.isdigit() else value
+
+
+class CameraRegistry:
+    """Which camera (and at what frame-rate cap) each session watches."""
+
+    def __init__(self, default_source=0):
+        self.default_source = default_source
+        self._lock = threading.Lock()
+        self._by_session = {}  # session_id -> (source, max_fps)
+
+    def set(self, session_id, source, max_fps=None):
+        with self._lock:
+            self._by_session[session_id] = (parse_source(source), max_fps)
+
+    def get(self, session_id):
+        with self._lock:
+            return self._by_session.get(session_id, (self.default_source, None))
+
+    def remove(self, session_id):
+        with self._lock:
+            self._by_session.pop(session_id, None)
+
+    def all(self):
+        with self._lock:
+            return dict(self._by_session)
@@ -1,27 +1,36 @@
-import os, uuid, time, cv2, numpy as np
-import psutil, threading
+import os, uuid, time, shutil, cv2, numpy as np
 from datetime import datetime
 from fastapi import FastAPI, UploadFile, Form, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse, HTMLResponse
+from fastapi.responses import (StreamingResponse, FileResponse, HTMLResponse, PlainTextResponse,
+                               Response, JSONResponse)
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session as SASession
-from typing import Optional, Dict, Tuple
-
-from backend.db_models import Base, User, Student, Session as DBSession, Behavior
-from backend.auth import verify_jwt, ensure_bootstrap_teacher, create_user, login as auth_login
-from backend.helpers import preprocess_face, simple_embedding, cosine_similarity
-from backend.detection import FaceDetector, draw_boxes
-from backend.behavior import classify_behavior
+from sqlalchemy.orm import sessionmaker, selectinload, joinedload, Session as SASession
+from typing import Optional
+
+from backend.db_models import User, Student, Session as DBSession, Behavior
+from backend.auth import (get_current_user, ensure_bootstrap_teacher, create_user,
+                          login as auth_login, hash_pw_async, hash_pw_pooled)
+from backend.helpers import pack_embedding
+from backend.database import make_engine
+from backend.migrate import upgrade_db, MIGRATE_ON_STARTUP
+from backend.gallery import FaceGallery
+from backend.pipeline import FrameAnalyzer, StreamPipeline
+from backend.tracking import DET_INTERVAL
+from backend.runtime import VisionRuntime, PRELOAD
+from backend.broker import CameraBroker, CameraInUse
+from backend.inference import CameraRegistry
+from backend.writer import BehaviorWriter
+from backend.offline import OfflineJobs
+from backend import summaries, metrics, profiler
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 import cv2, numpy as np, time
 from io import BytesIO
 
-DB_URL = "sqlite:///db.sqlite3"
-engine = create_engine(DB_URL, echo=False, future=True)
-Base.metadata.create_all(engine)
+engine = make_engine()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 origins = [
@@ -38,67 +47,109 @@ app.add_middleware(
     allow_methods=["*"], allow_headers=["*"]
 )
 
-detector = FaceDetector()
-cpu_samples = []
-# once per session tracking: attentive/absent
-_saved_once: Dict[Tuple[int,int,str], bool] = {}
-SAVE_INTERVAL = 30
-_last_saved: Dict[Tuple[int,int,str], float] = {}
+cameras = CameraRegistry()
+behavior_writer = BehaviorWriter(engine).start()
+# the embedding provider, the gallery matrix and the detector/FaceMesh stack
+# are all built on first use (models at startup with SANAD_PRELOAD_MODELS=1)
+gallery = FaceGallery(SessionLocal)
+vision = VisionRuntime(lambda: gallery.provider)
+broker = CameraBroker()
+offline_jobs = OfflineJobs()
+
+@app.on_event("startup")
+def migrate_schema():
+    # serialized across workers by a lock, see backend.migrate.upgrade_db
+    if MIGRATE_ON_STARTUP:
+        upgrade_db(engine)
+
+@app.on_event("startup")
+def bootstrap():
+    db = SessionLocal()
+    try:
+        ensure_bootstrap_teacher(db)
+        # re-embed students stored by another SANAD_EMBEDDER here, not on the
+        # first match of a stream thread; the matrix itself stays unloaded
+        gallery.reembed_stale(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def preload_models():
+    if PRELOAD:
+        vision.load_async()
+
+@app.on_event("shutdown")
+def flush_behavior_writer():
+    behavior_writer.close()
+    vision.close()
 
 def get_db():
     db = SessionLocal()
     try:
-        ensure_bootstrap_teacher(db)
         yield db
     finally:
         db.close()
 
-def cpu_monitor():
-    while True:
-        cpu_samples.append(psutil.cpu_percent(interval=1))
-        if len(cpu_samples) >= 30:
-            avg = sum(cpu_samples) / len(cpu_samples)
-            print("CPU AVG (%) on current device:", avg)
-            cpu_samples.clear()
-
-threading.Thread(target=cpu_monitor, daemon=True).start()
-# ---- Auth (inner style) ------------------------------------------------------
-
-def require_auth(request: Request, token: str = Query(None, alias="auth")):
-    if not token:
-        hdr = request.headers.get("Authorization", "")
-        if hdr.startswith("Bearer "):
-            token = hdr.replace("Bearer ", "").strip()
-    if token and token.startswith("Bearer "):
-        token = token.replace("Bearer ", "").strip()
-    return token
-
-def get_user(token: Optional[str] = Depends(require_auth)):
-    def inner(request: Request):
-        t = token
-        if not t:
-            hdr = request.headers.get("Authorization", "")
-            if hdr.startswith("Bearer "):
-                t = hdr.replace("Bearer ", "").strip()
-        if not t:
-            raise HTTPException(401, "Unauthorized")
-        try:
-            return verify_jwt(t)
-        except Exception:
-            raise HTTPException(401, "Unauthorized")
-    return inner
-
-# convenience dependency to resolve the inner()
-def get_current_user(request: Request, get_user_fn = Depends(get_user)):
-    return get_user_fn(request)
+# ---- Metrics -----------------------------------------------------------------
+
+metrics.ACTIVE_STREAMS.set_function(lambda: len(broker.active()))
+metrics.STREAM_VIEWERS.set_function(lambda: sum(n for _, n in broker.active().values()))
+metrics.GALLERY_SIZE.set_function(lambda: len(gallery))
+metrics.WRITER_QUEUE.set_function(lambda: behavior_writer.stats()["queued"])
+metrics.MODELS_READY.set_function(lambda: int(vision.ready))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def readiness():
+    """Model status. 503 only while SANAD_PRELOAD_MODELS is loading or failed;
+    with lazy loading an API-only worker is ready before any model is."""
+    st = vision.status()
+    if (PRELOAD or st["state"] == "failed") and st["state"] != "ready":
+        return JSONResponse(st, status_code=503)
+    return st
+
+@app.get("/debug/traces")
+def recent_traces(limit: int = Query(50, ge=1, le=500), u = Depends(get_current_user)):
+    """Per-stage spans of sampled frames (SANAD_TRACE_SAMPLE)."""
+    if not u.get("is_teacher"):
+        raise HTTPException(403, "forbidden")
+    return {"sample": metrics.TRACER.sample, "traces": metrics.TRACER.recent(limit)}
+
+@app.post("/debug/profile")
+def profile_streams(
+    seconds: float = Query(10.0, gt=0, le=profiler.MAX_SECONDS),
+    mode: str = Query("collapsed", pattern="^(collapsed|pstats|prof)$"),
+    interval_ms: float = Query(5.0, ge=1, le=100),
+    session_id: Optional[int] = None,
+    u = Depends(get_current_user),
+):
+    """Profile the running streams for `seconds`; see backend/profiler.py for the modes."""
+    if not u.get("is_teacher"):
+        raise HTTPException(403, "forbidden")
+    prefix = f"session-{session_id}-" if session_id is not None else ""
+    try:
+        run = profiler.ProfileRun(mode, seconds, interval_ms / 1000.0, prefix).run()
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(409, str(e))
+    if mode == "prof":
+        return Response(run.prof_bytes(), media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="sanad.prof"'})
+    return PlainTextResponse(run.collapsed() if mode == "collapsed" else run.pstats_text())
+
+# ---- Auth --------------------------------------------------------------------
+# get_current_user (backend.auth) reads ?auth= or the Bearer header and
+# verifies the JWT in one pass, using the verified-token cache.
 
 # ---- Routes ------------------------------------------------------------------
 # ===============================
 # LOGIN
 # ===============================
 @app.post("/auth/login")
-def login(email: str = Form(...), password: str = Form(...), db: SASession = Depends(get_db)):
-    res = auth_login(db, email, password)
+async def login(email: str = Form(...), password: str = Form(...), db: SASession = Depends(get_db)):
+    res = await auth_login(db, email, password)
     if "error" in res:
         raise HTTPException(401, res["error"])
     return res
@@ -125,7 +176,7 @@ def get_user(user_id: int, db: SASession = Depends(get_db), u=Depends(get_curren
 
 
 @app.post("/users")
-def create_user_account(
+async def create_user_account(
     name: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
@@ -135,14 +186,14 @@ def create_user_account(
 ):
     if not u.get("is_teacher"):
         raise HTTPException(403, "forbidden")
-    res = create_user(db, name, email, password, is_teacher)
+    res = await create_user(db, name, email, password, is_teacher)
     if "error" in res:
         raise HTTPException(409, res["error"])
     return res
 
 
 @app.put("/users/{user_id}")
-def update_user(
+async def update_user(
     user_id: int,
     name: str = Form(None),
     email: str = Form(None),
@@ -153,12 +204,17 @@ def update_user(
 ):
     if not u.get("is_teacher"):
         raise HTTPException(403, "forbidden")
+    # bcrypt on the bounded hash executor, the DB work on the threadpool
+    password_hash = await hash_pw_async(password) if password else None
+    return await run_in_threadpool(_update_user, db, user_id, name, email, password_hash, is_teacher)
+
+def _update_user(db, user_id, name, email, password_hash, is_teacher):
     user = db.query(User).get(user_id)
     if not user:
         raise HTTPException(404, "user not found")
     if name: user.name = name
     if email: user.email = email
-    if password: user.password_hash = hash_password(password)
+    if password_hash: user.password_hash = password_hash
     if is_teacher is not None: user.is_teacher = is_teacher
     db.commit()
     return user.to_dict()
@@ -180,20 +236,88 @@ def delete_user(user_id: int, db: SASession = Depends(get_db), u=Depends(get_cur
 # ===============================
 @app.get("/students")
 def list_students(db: SASession = Depends(get_db), u = Depends(get_current_user)):
-    if u.get("is_teacher"):
-        studs = db.query(Student).all()
-    else:
-        studs = db.query(Student).filter(Student.parent_id == u["sub"]).all()
-    return [s.to_dict() for s in studs]
+    # parent emails in one extra query; embedding columns are deferred on the model
+    q = db.query(Student).options(selectinload(Student.parent))
+    if not u.get("is_teacher"):
+        q = q.filter(Student.parent_id == u["sub"])
+    return [s.to_dict() for s in q.all()]
 
 @app.get("/students/{student_id}")
 def get_student(student_id: int, db: SASession = Depends(get_db), u = Depends(get_current_user)):
-    s = db.query(Student).get(student_id)
+    s = db.query(Student).options(joinedload(Student.parent)).filter(Student.id == student_id).first()
     if not s:
         raise HTTPException(404, "not found")
     if not u.get("is_teacher") and s.parent_id != u["sub"]:
         raise HTTPException(403, "forbidden")
-    return s.to_dict(include_behaviors=True)
+    # history is paged separately, see /students/{id}/behaviors
+    return s.to_dict()
+
+def _parse_cursor(cursor: str):
+    try:
+        ts, bid = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(ts), int(bid)
+    except ValueError:
+        raise HTTPException(422, "invalid cursor")
+
+@app.get("/students/{student_id}/behaviors")
+def student_behaviors(
+    student_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    session_id: Optional[int] = None,
+    behavior: Optional[str] = None,
+    is_exam: Optional[bool] = None,
+    db: SASession = Depends(get_db),
+    u = Depends(get_current_user),
+):
+    """Newest-first behavior history, keyset-paginated on (timestamp, id).
+
+    Pass the returned `next_cursor` as `cursor` to get the following page;
+    `behavior` accepts a comma-separated list (e.g. "sleeping,talking").
+    """
+    parent_id = db.query(Student.parent_id).filter(Student.id == student_id).first()
+    if not parent_id:
+        raise HTTPException(404, "not found")
+    if not u.get("is_teacher") and parent_id[0] != u["sub"]:
+        raise HTTPException(403, "forbidden")
+
+    q = (
+        db.query(
+            Behavior.id, Behavior.session_id, Behavior.behavior,
+            Behavior.confidence, Behavior.timestamp, DBSession.is_exam,
+        )
+        .join(DBSession, DBSession.id == Behavior.session_id)
+        .filter(Behavior.student_id == student_id)
+    )
+    if date_from:
+        q = q.filter(Behavior.timestamp >= date_from)
+    if date_to:
+        q = q.filter(Behavior.timestamp < date_to)
+    if session_id is not None:
+        q = q.filter(Behavior.session_id == session_id)
+    if behavior:
+        q = q.filter(Behavior.behavior.in_([b.strip() for b in behavior.split(",") if b.strip()]))
+    if is_exam is not None:
+        q = q.filter(DBSession.is_exam == is_exam)
+    if cursor:
+        ts, bid = _parse_cursor(cursor)
+        q = q.filter((Behavior.timestamp < ts) | ((Behavior.timestamp == ts) & (Behavior.id < bid)))
+
+    rows = q.order_by(Behavior.timestamp.desc(), Behavior.id.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{
+        "id": r.id,
+        "session_id": r.session_id,
+        "behavior": r.behavior,
+        "confidence": r.confidence,
+        "timestamp": r.timestamp.isoformat() if r.timestamp else None,
+        "is_exam": bool(r.is_exam),
+    } for r in rows]
+    next_cursor = f"{rows[-1].timestamp.isoformat()}_{rows[-1].id}" if more and rows[-1].timestamp else None
+    return {"items": items, "next_cursor": next_cursor}
 
 @app.post("/students")
 def create_student(
@@ -214,8 +338,7 @@ def create_student(
         raise HTTPException(400, "invalid image")
 
     face = cv2.resize(img, (112, 112))
-    emb = simple_embedding(face)
-    emb_str = ",".join([f"{v:.6f}" for v in emb])
+    emb = gallery.provider.embed(face)
 
     os.makedirs("images", exist_ok=True)
     filename = f"{uuid.uuid4()}{os.path.splitext(photo.filename or '.jpg')[1]}"
@@ -226,12 +349,11 @@ def create_student(
     if parent_email:
         parent = db.query(User).filter(User.email == parent_email).first()
         if not parent:
-            from backend.auth import hash_pw
             rand_pw = uuid.uuid4().hex[:10]
             parent = User(
                 name=parent_email.split("@")[0],
                 email=parent_email,
-                password_hash=hash_pw(rand_pw),
+                password_hash=hash_pw_pooled(rand_pw),
                 is_teacher=False
             )
             db.add(parent)
@@ -242,11 +364,13 @@ def create_student(
         full_name=full_name,
         class_name=class_name,
         photo_path=path,
-        embedding=emb_str,
+        embedding_blob=pack_embedding(emb),
+        embedding_model=gallery.provider.name,
         parent_id=parent_id
     )
     db.add(s)
     db.commit()
+    gallery.upsert(s.id, s.full_name, s.embedding_blob)
     return s.to_dict()
 
 @app.put("/students/{student_id}")
@@ -271,12 +395,11 @@ def update_student(
     if parent_email:
         parent = db.query(User).filter(User.email == parent_email).first()
         if not parent:
-            from backend.auth import hash_pw
             rand_pw = uuid.uuid4().hex[:10]
             parent = User(
                 name=parent_email.split("@")[0],
                 email=parent_email,
-                password_hash=hash_pw(rand_pw),
+                password_hash=hash_pw_pooled(rand_pw),
                 is_teacher=False
             )
             db.add(parent)
@@ -292,8 +415,12 @@ def update_student(
         path = os.path.join("images", filename)
         cv2.imwrite(path, img)
         s.photo_path = path
+        s.embedding_blob = pack_embedding(gallery.provider.embed(cv2.resize(img, (112, 112))))
+        s.embedding_model = gallery.provider.name
+        s.embedding = None
 
     db.commit()
+    gallery.upsert(s.id, s.full_name, s.embedding_blob)
     return s.to_dict()
 
 
@@ -306,6 +433,7 @@ def delete_student(student_id: int, db: SASession = Depends(get_db), u = Depends
         raise HTTPException(404, "not found")
     db.delete(s)
     db.commit()
+    gallery.remove(student_id)
     return {"status": "deleted"}
 
 # ===============================
@@ -314,14 +442,70 @@ def delete_student(student_id: int, db: SASession = Depends(get_db), u = Depends
 @app.post("/sessions/start")
 def start_session(
     is_exam: bool = Form(False),
+    class_name: str = Form(None),
+    camera: str = Form("0"),
+    max_fps: float = Form(None),
     db: SASession = Depends(get_db),
     u = Depends(get_current_user),
 ):
     if not u.get("is_teacher"):
         raise HTTPException(403, "forbidden")
-    sess = DBSession(teacher_id=int(u["sub"]), active=True, is_exam=is_exam)  # use sub
+    sess = DBSession(teacher_id=int(u["sub"]), active=True, is_exam=is_exam,
+                     class_name=class_name or None)  # use sub
     db.add(sess); db.commit(); db.refresh(sess)
-    return {"ok": True, "session_id": sess.id, "is_exam": sess.is_exam}
+    cameras.set(sess.id, camera, max_fps)
+    return {"ok": True, "session_id": sess.id, "is_exam": sess.is_exam, "class_name": sess.class_name}
+
+
+@app.post("/sessions/{session_id}/analyze-video")
+def analyze_session_video(
+    session_id: int,
+    video: UploadFile,
+    step: int = Form(None),
+    started_at: datetime = Form(None),
+    db: SASession = Depends(get_db),
+    u = Depends(get_current_user),
+):
+    """Analyze a recorded lesson in the background; poll /offline/{job_id}."""
+    if not u.get("is_teacher"):
+        raise HTTPException(403, "forbidden")
+    if not db.query(DBSession).get(session_id):
+        raise HTTPException(404, "session not found")
+    os.makedirs("videos", exist_ok=True)
+    path = os.path.join("videos", f"{uuid.uuid4()}{os.path.splitext(video.filename or '.mp4')[1]}")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(video.file, f)
+    kw = {"step": step} if step else {}
+    job = offline_jobs.start(engine, path, session_id, delete=True, started_at=started_at, **kw)
+    return {"ok": True, "job_id": job["id"]}
+
+
+@app.get("/offline/{job_id}")
+def offline_status(job_id: str, u = Depends(get_current_user)):
+    if not u.get("is_teacher"):
+        raise HTTPException(403, "forbidden")
+    job = offline_jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, "job not found")
+    return job
+
+
+@app.put("/sessions/{session_id}/camera")
+def set_session_camera(
+    session_id: int,
+    camera: str = Form(...),
+    max_fps: float = Form(None),
+    db: SASession = Depends(get_db),
+    u = Depends(get_current_user),
+):
+    if not u.get("is_teacher"):
+        raise HTTPException(403, "forbidden")
+    sess = db.query(DBSession).get(session_id)
+    if not sess or not sess.active:
+        raise HTTPException(404, "not active")
+    cameras.set(session_id, camera, max_fps)
+    source, fps = cameras.get(session_id)
+    return {"ok": True, "session_id": session_id, "camera": source, "max_fps": fps}
 
 
 @app.post("/sessions/stop/{session_id}")
@@ -333,9 +517,15 @@ def stop_session(session_id: int, db: SASession = Depends(get_db), u = Depends(g
     if not sess or not sess.active:
         raise HTTPException(404, "not active")
 
-    # close session
+    # close session and its camera producer
     sess.active = False
     sess.end_time = datetime.utcnow()
+    broker.stop_session(session_id)
+    cameras.remove(session_id)
+    # rows still queued by the stream must be in before absentees are computed;
+    # one more wait, then give up without committing so the stop can be retried
+    if not (behavior_writer.flush() or behavior_writer.flush()):
+        raise HTTPException(503, "behavior rows are still being written, retry")
 
     # students that already have any behavior logged in this session
     seen_ids_q = (
@@ -344,8 +534,12 @@ def stop_session(session_id: int, db: SASession = Depends(get_db), u = Depends(g
           .distinct()
     )
 
-    # students never detected during this session
-    missing_ids = [sid for (sid,) in db.query(Student.id).filter(~Student.id.in_(seen_ids_q)).all()]
+    # students of the session's class (all students for class-less sessions)
+    # never detected during this session
+    roster = db.query(Student.id).filter(~Student.id.in_(seen_ids_q))
+    if sess.class_name:
+        roster = roster.filter(Student.class_name == sess.class_name)
+    missing_ids = [sid for (sid,) in roster.all()]
 
     # one “absent” row per missing student
     if missing_ids:
@@ -353,7 +547,10 @@ def stop_session(session_id: int, db: SASession = Depends(get_db), u = Depends(g
             Behavior(session_id=session_id, student_id=sid, behavior="absent", confidence=0.0)
             for sid in missing_ids
         ])
+        db.flush()
 
+    # finalize the session's rollup from its raw events
+    summaries.rebuild(db.connection(), session_id)
     db.commit()
     return {"ok": True, "absent_added": len(missing_ids)}
 
@@ -376,128 +573,96 @@ def my_sessions(db: SASession = Depends(get_db), u = Depends(get_current_user)):
         "id": s.id,
         "active": s.active,
         "is_exam": s.is_exam,
+        "class_name": s.class_name,
         "start_time": s.start_time.isoformat(),
         "end_time": s.end_time.isoformat() if s.end_time else None,
     } for s in sess]
 
+@app.get("/behaviors/summary")
+def behavior_summary(
+    group_by: str = "student,behavior",
+    session_id: Optional[int] = None,
+    student_id: Optional[int] = None,
+    class_name: Optional[str] = None,
+    behavior: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: SASession = Depends(get_db),
+    u = Depends(get_current_user),
+):
+    """Behavior counts from the pre-aggregated rollup.
+
+    `group_by` is a comma-separated subset of session, student, class,
+    behavior, day, week (its Monday's date), exam; date filters apply to the
+    session start time.
+    """
+    groups = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in summaries.GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(422, f"unknown group_by: {', '.join(unknown)}")
+    behaviors = [b.strip() for b in behavior.split(",") if b.strip()] if behavior else None
+    return summaries.query(
+        db, groups, session_id=session_id, student_id=student_id, class_name=class_name,
+        behavior=behaviors, date_from=date_from, date_to=date_to,
+        parent_id=None if u.get("is_teacher") else u["sub"],
+    )
+
+
 @app.get("/detect/stream")
-def detect_stream(session_id: int, db: SASession = Depends(get_db)):
+def detect_stream(
+    session_id: int,
+    det_size: Optional[int] = None,
+    det_interval: Optional[int] = None,
+    width: Optional[int] = Query(None, ge=16),
+    quality: Optional[int] = Query(None, ge=10, le=100),
+    fps: Optional[float] = Query(None, gt=0),
+    adaptive: bool = False,
+    db: SASession = Depends(get_db),
+):
     # verify active session
     sess = db.query(DBSession).get(session_id)
     if not sess or not sess.active:
         raise HTTPException(404, "session not active")
 
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        raise HTTPException(500, "camera not available")
-
-    last_saved = {}
-    SAVE_INTERVAL = 5.0  # seconds
-    MIN_SIM = 0.8        # require high confidence
-    MIN_MARGIN = 0.05     # best - second-best difference
+    source, max_fps = cameras.get(session_id)
+    # first stream loads and warms the models (outside the broker lock)
+    try:
+        vision.ensure()
+    except RuntimeError as e:
+        raise HTTPException(503, f"models unavailable: {e}")
+
+    def make_pipeline():
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise HTTPException(500, "camera not available")
+        # recorded files are replayed at their own frame rate instead of dropping
+        live = not (isinstance(source, str) and os.path.isfile(source))
+        cap_fps = max_fps or (None if live else (cap.get(cv2.CAP_PROP_FPS) or 25.0))
+        if vision.process_pool is not None:
+            remote = vision.process_pool.client_for(session_id, det_interval or DET_INTERVAL)
+            analyzer = FrameAnalyzer(session_id, None, gallery.provider, gallery, det_size, det_interval,
+                                     remote=remote)
+        else:
+            detector = vision.inference_pool.detector_for(session_id)
+            analyzer = FrameAnalyzer(session_id, detector, gallery.provider, gallery, det_size, det_interval).warm()
+        # width/quality apply to the shared encoder, so the first viewer sets them
+        return StreamPipeline(cap, analyzer, behavior_writer, name=f"session-{session_id}",
+                              max_fps=cap_fps, live=live, out_width=width, jpeg_quality=quality)
+
+    # every viewer of a camera shares one capture + inference producer
+    try:
+        pipeline = broker.subscribe(source, session_id, make_pipeline)
+    except CameraInUse as e:
+        raise HTTPException(409, str(e))
 
     def gen_frames():
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                break
-
-            start_t = time.time()
-
-            faces = detector.predict(frame)  # [{'bbox': (x,y,w,h), 'landmarks': ...}]
-            labels = []
-            db2 = SessionLocal()
-            try:
-                students = db2.query(Student).all()
-
-                for f in faces:
-                    crop = preprocess_face(frame, f["bbox"])
-                    if crop is None:
-                        labels.append("unknown")
-                        continue
-
-                    emb = simple_embedding(crop)
-
-                    best_student, best_name = None, "unknown"
-                    best_sim, second_sim = -1.0, -1.0
-
-                    for s in students:
-                        if not s.embedding:
-                            continue
-                        txt = s.embedding.strip()
-                        if txt.startswith("[") and txt.endswith("]"):
-                            txt = txt[1:-1]
-                        try:
-                            ref = np.array(
-                                [float(x) for x in txt.replace("\n", " ").split(",")],
-                                dtype=np.float32
-                            )
-                        except Exception:
-                            continue
-
-                        sim = cosine_similarity(emb, ref)
-                        if sim > best_sim:
-                            second_sim = best_sim
-                            best_sim = sim
-                            best_student = s
-                            best_name = s.full_name
-                        elif sim > second_sim:
-                            second_sim = sim
-
-                    # apply similarity and margin test
-                    if best_student and best_sim >= MIN_SIM and (best_sim - second_sim) >= MIN_MARGIN:
-                        labels.append(f"{best_name} ({best_sim:.2f})")
-
-                        landmarks = f.get("landmarks", [])
-                        behavior = classify_behavior(frame, f["bbox"], landmarks)
-
-                        if behavior != "attentive":
-                            key = (best_student.id, behavior)
-                            now = time.time()
-                            if key not in last_saved or (now - last_saved[key]) > SAVE_INTERVAL:
-                                rec = Behavior(
-                                    session_id=session_id,
-                                    student_id=best_student.id,
-                                    behavior=behavior,
-                                    confidence=float(best_sim),
-                                    timestamp=datetime.utcnow()
-                                )
-                                print("Behavior detection accuracy (%):", float(best_sim))
-                                try:
-                                    t1 = time.time()
-                                    db2.add(rec)
-                                    db2.commit()
-                                    t2 = time.time()
-                                    print("DB WRITE LATENCY:", (t2 - t1) * 1000, "ms")
-                                except Exception as e:
-                                    db2.rollback()
-                                    print("DB error:", e)
-                                last_saved[key] = now
-                    else:
-                        labels.append("unknown")
-            finally:
-                db2.close()
-
-            end_t = time.time()
-            if not hasattr(gen_frames, "lat_samples"):
-                gen_frames.lat_samples = []
-            gen_frames.lat_samples.append(end_t - start_t)
-
-            if len(gen_frames.lat_samples) >= 300:
-                avg = sum(gen_frames.lat_samples) / len(gen_frames.lat_samples)
-                print("AVG LATENCY (sec/frame):", avg)
-                gen_frames.lat_samples.clear()
-
-            annotated = draw_boxes(frame.copy(), faces, labels)
-            ret, buf = cv2.imencode(".jpg", annotated)
-            if not ret:
-                continue
-            jpg = buf.tobytes()
+        for jpg in pipeline.stream(max_fps=fps, adaptive=adaptive):
             yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
 
-        cap.release()
-
-    return StreamingResponse(gen_frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+    # runs after the response ends, including when the client disconnects
+    release = BackgroundTask(broker.release, source, pipeline)
+    return StreamingResponse(gen_frames(), media_type="multipart/x-mixed-replace; boundary=frame",
+                             background=release)
 
 
 @app.get("/images/{filename}")
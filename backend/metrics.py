@@ -0,0 +1,202 @@
+import os, random, threading, time
+from collections import deque
+
+import psutil
+
+# fraction of frames that record a per-stage trace (0 disables tracing)
+TRACE_SAMPLE = float(os.getenv("SANAD_TRACE_SAMPLE", "0"))
+TRACE_KEEP = int(os.getenv("SANAD_TRACE_KEEP", "200"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(k, "")) for k in self.labelnames)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from set_function()."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), kind=None):
+        super().__init__(name, help, labelnames)
+        self.kind = kind or self.kind
+        self._values = {}
+        self._fn = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn):
+        """fn() returns a number, or a {label tuple: number} dict for labelled gauges."""
+        self._fn = fn
+
+    def _samples(self):
+        if self._fn is not None:
+            try:
+                v = self._fn()
+            except Exception:
+                return []
+            items = v.items() if isinstance(v, dict) else [((), v)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            else:
+                s[len(self.buckets)] += 1
+            s[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        out = []
+        names = self.labelnames + ("le",)
+        for key, s in series.items():
+            acc = 0
+            for b, n in zip(self.buckets + ("+Inf",), s[:-1]):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(names, key + (b,))} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {s[-1]}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+REGISTRY = []
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for m in REGISTRY:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+# ---- application metrics -----------------------------------------------------
+
+# capture, detect, embed, match, mesh, inference, encode (per frame) and db_flush
+STAGE_SECONDS = Histogram("sanad_stage_seconds", "Pipeline stage latency", ("stage",))
+DB_ROWS = Counter("sanad_db_rows_total", "Behavior rows written, retried, failed or dropped", ("result",))
+FRAMES = Counter("sanad_frames_total", "Frames through inference")
+FRAMES_DROPPED = Counter("sanad_frames_dropped_total", "Frames dropped before reaching a viewer", ("reason",))
+PIPELINE_ERRORS = Counter("sanad_pipeline_errors_total", "Stream pipelines ended by an exception", ("stage",))
+FACES_PER_FRAME = Histogram("sanad_faces_per_frame", "Faces tracked per analyzed frame",
+                            buckets=COUNT_BUCKETS)
+ACTIVE_STREAMS = Gauge("sanad_active_streams", "Cameras with a running capture/inference pipeline")
+STREAM_VIEWERS = Gauge("sanad_stream_viewers", "Connected MJPEG viewers")
+GALLERY_SIZE = Gauge("sanad_gallery_students", "Students in the face gallery")
+WRITER_QUEUE = Gauge("sanad_db_writer_queue", "Behavior rows waiting for the writer")
+MODELS_READY = Gauge("sanad_models_ready", "1 once the detector and FaceMesh are loaded and warm")
+
+_proc = psutil.Process()
+PROCESS_CPU = Gauge("process_cpu_seconds_total", "User and system CPU time of this process",
+                    kind="counter")
+PROCESS_CPU.set_function(lambda: round(sum(_proc.cpu_times()[:2]), 3))
+PROCESS_RSS = Gauge("process_resident_memory_bytes", "Resident set size of this process")
+PROCESS_RSS.set_function(lambda: _proc.memory_info().rss)
+PROCESS_THREADS = Gauge("process_threads", "Threads in this process")
+PROCESS_THREADS.set_function(lambda: _proc.num_threads())
+
+
+# ---- sampled traces ----------------------------------------------------------
+
+class Trace:
+    __slots__ = ("name", "attrs", "start", "t0", "spans")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []  # (stage, offset_ms, duration_ms)
+
+    def add(self, stage, t0, seconds):
+        """t0 is a perf_counter() reading, like the ones StageTimer takes."""
+        self.spans.append((stage, round((t0 - self.t0) * 1000, 3), round(seconds * 1000, 3)))
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start, **self.attrs,
+                "spans": [{"stage": s, "offset_ms": o, "ms": d} for s, o, d in self.spans]}
+
+
+class Tracer:
+    """Keeps the last `keep` traces of a `sample` fraction of frames."""
+
+    def __init__(self, sample=TRACE_SAMPLE, keep=TRACE_KEEP):
+        self.sample = sample
+        self._traces = deque(maxlen=keep)
+
+    def start(self, name, **attrs):
+        if self.sample <= 0 or random.random() >= self.sample:
+            return None
+        return Trace(name, attrs)
+
+    def finish(self, trace, **attrs):
+        if trace is not None:
+            trace.attrs.update(attrs)
+            self._traces.append(trace)
+
+    def recent(self, limit=50):
+        return [t.to_dict() for t in list(self._traces)[-limit:]]
+
+
+TRACER = Tracer()
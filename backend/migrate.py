@@ -0,0 +1,66 @@
+import os, sys, hashlib, tempfile
+from contextlib import contextmanager
+from sqlalchemy import text
+
+# let the app migrate on startup; set to 0 when `python -m backend.migrate`
+# runs once per deploy instead
+MIGRATE_ON_STARTUP = os.getenv("SANAD_MIGRATE_ON_STARTUP", "1") == "1"
+
+
+def alembic_config(connection=None):
+    from alembic.config import Config
+    here = os.path.dirname(os.path.abspath(__file__))
+    cfg = Config(os.path.join(os.path.dirname(here), "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(here, "alembic"))
+    if connection is not None:
+        cfg.attributes["connection"] = connection
+    return cfg
+
+
+@contextmanager
+def _migration_lock(engine):
+    """Host-wide lock per DB URL, so uvicorn workers starting together run
+    create_all/upgrade one after the other instead of racing the same DDL."""
+    url = engine.url.render_as_string(hide_password=False)
+    path = os.path.join(tempfile.gettempdir(),
+                        f"sanad-migrate-{hashlib.sha1(url.encode()).hexdigest()[:12]}.lock")
+    with open(path, "a+") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10 s; keep waiting
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+
+def upgrade_db(engine):
+    """Create missing tables and bring the schema to the latest Alembic revision.
+
+    Revisions are written to be idempotent, so this is also safe on DBs that
+    were created by Base.metadata.create_all before Alembic was introduced.
+    """
+    from alembic import command
+    from backend.db_models import Base
+    with _migration_lock(engine):
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            command.upgrade(alembic_config(conn), "head")
+
+
+if __name__ == "__main__":
+    # one-shot: python -m backend.migrate [db_url] [--vacuum]
+    from backend.database import DB_URL, make_engine
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    engine = make_engine(args[0] if args else DB_URL)
+    upgrade_db(engine)
+    print("schema at head")
+    if "--vacuum" in sys.argv:
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+        print("vacuum done")
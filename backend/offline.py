@@ -0,0 +1,208 @@
+import os, sys, json, time, uuid, threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+OFFLINE_WORKERS = int(os.getenv("SANAD_OFFLINE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+FRAME_STEP = int(os.getenv("SANAD_OFFLINE_STEP", "5"))  # analyze every Nth decoded frame
+BATCH = int(os.getenv("SANAD_OFFLINE_BATCH", "8"))      # frames per detector forward pass
+MIN_CHUNK_FRAMES = 1500  # don't split a video finer than ~1 min at 25 fps
+
+# ---- worker process ----------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(db_url):
+    # one detector/gallery per process, loaded once for all its chunks
+    from sqlalchemy.orm import sessionmaker
+    from backend.database import make_engine
+    from backend.detection import FaceDetector
+    from backend.gallery import FaceGallery
+    from backend.helpers import get_embedding_provider
+
+    engine = make_engine(db_url)
+    embedder = get_embedding_provider()
+    _worker["detector"] = FaceDetector()
+    _worker["embedder"] = embedder
+    _worker["gallery"] = FaceGallery(sessionmaker(bind=engine), embedder)
+
+
+def _analyze_chunk(path, session_id, start, end, step, fps, base_ts, det_size, batch):
+    """Behavior rows for frames [start, end) of the video; (rows, decoded, analyzed)."""
+    import cv2
+    from backend.pipeline import FrameAnalyzer
+
+    detector = _worker["detector"]
+    analyzer = FrameAnalyzer(session_id, detector, _worker["embedder"], _worker["gallery"],
+                             det_size=det_size, det_interval=1)
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    rows, pending = [], []
+    decoded = analyzed = 0
+
+    def flush():
+        nonlocal analyzed
+        dets = detector.predict_batch([f for _, f in pending], img_size=analyzer.img_size)
+        for (idx, frame), d in zip(pending, dets):
+            rows.extend(analyzer.process(frame, now=base_ts + idx / fps, detections=d)[3])
+        analyzed += len(pending)
+        pending.clear()
+
+    try:
+        for idx in range(start, end):
+            # grab() skips the colour conversion/copy for frames we drop
+            if (idx - start) % step:
+                if not cap.grab():
+                    break
+                decoded += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            decoded += 1
+            pending.append((idx, frame))
+            if len(pending) >= batch:
+                flush()
+        if pending:
+            flush()
+    finally:
+        cap.release()
+    return rows, decoded, analyzed
+
+
+# ---- driver ------------------------------------------------------------------
+
+def video_info(path):
+    import cv2
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"cannot open video {path}")
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or 25.0
+    finally:
+        cap.release()
+
+
+def analyze_video(engine, path, session_id, started_at=None, step=FRAME_STEP,
+                  workers=OFFLINE_WORKERS, batch=BATCH, det_size=None, progress=None):
+    """Run the live detect -> identify -> behavior chain over a recorded lesson.
+
+    The video is split into one chunk per worker process; chunks are decoded
+    with frame skipping, detected in batches, and every resulting Behavior row
+    is bulk-inserted in one transaction at the end. Row timestamps are
+    `started_at` (default: the session start) plus the frame's video time.
+    Trackers and behavior timers restart at chunk boundaries.
+    """
+    from sqlalchemy import insert, select
+    from backend import summaries
+    from backend.db_models import Behavior, Session as DBSession
+
+    t0 = time.perf_counter()
+    total, fps = video_info(path)
+    if started_at is None:
+        with engine.connect() as conn:
+            started_at = conn.execute(select(DBSession.start_time).where(DBSession.id == session_id)).scalar()
+    started_at = started_at or datetime.utcnow()
+    if started_at.tzinfo is None:  # naive datetimes in this app are UTC
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    base_ts = started_at.timestamp()
+
+    if total > 0:
+        workers = max(1, min(workers, total // MIN_CHUNK_FRAMES or 1))
+        bounds = [total * i // workers for i in range(workers + 1)]
+    else:  # unknown length: one chunk until the decoder runs out
+        workers, bounds = 1, [0, 2 ** 31]
+    rows, decoded, analyzed = [], 0, 0
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(engine.url.render_as_string(hide_password=False),)) as pool:
+        futs = [pool.submit(_analyze_chunk, path, session_id, bounds[i], bounds[i + 1],
+                            max(1, step), fps, base_ts, det_size, max(1, batch))
+                for i in range(workers)]
+        for f in futs:
+            r, d, a = f.result()
+            rows += r; decoded += d; analyzed += a
+            if progress:
+                progress(decoded, total)
+
+    with engine.begin() as conn:
+        if rows:
+            conn.execute(insert(Behavior.__table__), rows)
+            summaries.apply_rows(conn, rows)
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "session_id": session_id,
+        "frames": total,
+        "decoded": decoded,
+        "analyzed": analyzed,
+        "rows": len(rows),
+        "workers": workers,
+        "seconds": round(elapsed, 2),
+        "decode_fps": round(decoded / elapsed, 1) if elapsed else 0.0,
+        "analyze_fps": round(analyzed / elapsed, 1) if elapsed else 0.0,
+        "realtime_x": round(decoded / fps / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+class OfflineJobs:
+    """Status of /sessions/{id}/analyze-video runs, kept in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def start(self, engine, path, session_id, delete=False, **kw):
+        """Run analyze_video in a thread; `delete` removes the file afterwards (uploads)."""
+        job_id = uuid.uuid4().hex[:12]
+        job = {"id": job_id, "session_id": session_id, "status": "running",
+               "progress": 0.0, "result": None, "error": None}
+        with self._lock:
+            self._jobs[job_id] = job
+
+        def progress(done, total):
+            job["progress"] = round(done / total, 3) if total else 0.0
+
+        def run():
+            try:
+                job["result"] = analyze_video(engine, path, session_id, progress=progress, **kw)
+                job["status"] = "done"
+            except Exception as e:
+                job["status"], job["error"] = "failed", str(e)
+            finally:
+                if delete:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+        threading.Thread(target=run, name=f"offline-{job_id}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+if __name__ == "__main__":
+    # python -m backend.offline VIDEO SESSION_ID [--step N] [--workers N] [--batch N]
+    #                                            [--det-size N] [--start ISO] [--db URL]
+    import argparse
+    from backend.database import DB_URL, make_engine
+
+    ap = argparse.ArgumentParser(prog="python -m backend.offline")
+    ap.add_argument("video")
+    ap.add_argument("session_id", type=int)
+    ap.add_argument("--step", type=int, default=FRAME_STEP)
+    ap.add_argument("--workers", type=int, default=OFFLINE_WORKERS)
+    ap.add_argument("--batch", type=int, default=BATCH)
+    ap.add_argument("--det-size", type=int, default=None)
+    ap.add_argument("--start", type=datetime.fromisoformat, default=None,
+                    help="UTC time of the first frame (default: session start)")
+    ap.add_argument("--db", default=DB_URL)
+    args = ap.parse_args()
+    stats = analyze_video(make_engine(args.db), args.video, args.session_id, args.start,
+                          args.step, args.workers, args.batch, args.det_size,
+                          progress=lambda d, t: print(f"decoded {d}/{t}", file=sys.stderr))
+    print(json.dumps(stats, indent=2))
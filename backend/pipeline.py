@@ -0,0 +1,509 @@
+import os, threading, time, traceback
+import cv2
+from collections import deque
+from datetime import datetime
+
+from backend.helpers import preprocess_face, appearance_signature
+from backend.tracking import FaceTracker, IdentityCache, DET_INTERVAL, det_size_for
+from backend.behavior import BehaviorStateStore, analyze_faces, face_key
+from backend.detection import draw_boxes
+from backend import metrics, profiler
+
+SAVE_INTERVAL = 5.0  # seconds between two rows of the same (student, behavior)
+# seconds between printed stage timing reports; 0 = /metrics only
+REPORT_EVERY = float(os.getenv("SANAD_STAGE_REPORT", "0"))
+JPEG_QUALITY = int(os.getenv("SANAD_JPEG_QUALITY", "80"))
+STREAM_WIDTH = int(os.getenv("SANAD_STREAM_WIDTH", "0"))  # 0 = camera resolution
+# adaptive viewers step through these (quality factor, frame-rate factor) levels
+ADAPT_LEVELS = ((1.0, 1.0), (0.85, 0.75), (0.7, 0.5), (0.55, 0.35), (0.45, 0.2))
+ADAPT_RECOVER = 30  # fast sends in a row before an adaptive viewer steps back up
+
+
+class LatestQueue:
+    """Bounded queue with a "latest wins" policy: a full put drops the oldest item."""
+
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """Queue item; returns True when an older item was dropped for it."""
+        with self._cond:
+            full = len(self._items) == self._items.maxlen
+            if full:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        return full
+
+    def get(self, timeout=None):
+        """Next item, or None once the queue is closed and drained / on timeout."""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class _Viewer:
+    """One subscriber of a FrameHub: its frame-rate cap and adaptive level."""
+    __slots__ = ("max_fps", "adaptive", "level", "calm")
+
+    def __init__(self, max_fps=None, adaptive=False):
+        self.max_fps = max_fps
+        self.adaptive = adaptive
+        self.level = 0
+        self.calm = 0
+
+    def gap(self, source_fps):
+        """Minimum seconds between two frames sent to this viewer."""
+        fps = self.max_fps or source_fps
+        if fps and self.adaptive:
+            fps *= ADAPT_LEVELS[self.level][1]
+        return 1.0 / fps if fps else 0.0
+
+    def observe(self, send_s, budget):
+        """Step down when sending a frame took longer than the frame budget."""
+        if not self.adaptive or budget <= 0:
+            return
+        if send_s > 1.5 * budget:
+            self.level = min(self.level + 1, len(ADAPT_LEVELS) - 1)
+            self.calm = 0
+        elif send_s < 0.5 * budget:
+            self.calm += 1
+            if self.calm >= ADAPT_RECOVER and self.level:
+                self.level -= 1
+                self.calm = 0
+
+
+class FrameHub:
+    """Latest encoded frame fanned out to any number of subscribers.
+
+    Each subscriber only ever sees the newest frame; frames it was too slow
+    for are skipped and counted in `skipped`. Frames are encoded once for all
+    subscribers, at the quality of the most constrained adaptive viewer.
+    """
+
+    def __init__(self, quality=JPEG_QUALITY):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._jpg = None
+        self._closed = False
+        self._viewers = set()
+        self._last_publish = None
+        self.quality = quality
+        self.fps = 0.0  # smoothed publish rate
+        self.skipped = 0
+
+    def publish(self, jpg):
+        now = time.perf_counter()
+        with self._cond:
+            if self._last_publish is not None and now > self._last_publish:
+                rate = 1.0 / (now - self._last_publish)
+                self.fps = rate if not self.fps else 0.9 * self.fps + 0.1 * rate
+            self._last_publish = now
+            self._seq += 1
+            self._jpg = jpg
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def has_viewers(self):
+        return bool(self._viewers)
+
+    def jpeg_quality(self):
+        with self._cond:
+            factor = min((ADAPT_LEVELS[v.level][0] for v in self._viewers), default=1.0)
+        return max(10, int(self.quality * factor))
+
+    def frames(self, timeout=1.0, max_fps=None, adaptive=False):
+        viewer = _Viewer(max_fps, adaptive)
+        with self._cond:
+            self._viewers.add(viewer)
+        try:
+            last, sent = self._seq, 0.0
+            while True:
+                with self._cond:
+                    if self._seq == last and not self._closed:
+                        self._cond.wait(timeout)
+                    if self._seq == last:
+                        if self._closed:
+                            return
+                        continue
+                    if self._seq - last > 1:
+                        self.skipped += self._seq - last - 1
+                        metrics.FRAMES_DROPPED.inc(self._seq - last - 1, reason="client")
+                    last, jpg = self._seq, self._jpg
+                gap = viewer.gap(self.fps)
+                wait = sent + gap - time.perf_counter()
+                if wait > 0:
+                    # rate-capped: sleep it off and send whatever is newest then
+                    time.sleep(wait)
+                    with self._cond:
+                        last, jpg = self._seq, self._jpg
+                t0 = time.perf_counter()
+                yield jpg
+                sent = time.perf_counter()
+                viewer.observe(sent - t0, gap or (1.0 / self.fps if self.fps else 0.0))
+        finally:
+            with self._cond:
+                self._viewers.discard(viewer)
+
+
+class StageTimer:
+    """Per-stage latency, exported as metrics.STAGE_SECONDS.
+
+    With REPORT_EVERY set, samples are also kept and printed as avg/p95.
+    """
+
+    def __init__(self, name="stream", report_every=REPORT_EVERY):
+        self.name = name
+        self.report_every = report_every
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._last_report = time.time()
+
+    def add(self, stage, seconds):
+        metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+        if self.report_every:
+            with self._lock:
+                self._samples.setdefault(stage, []).append(seconds)
+
+    def time(self, stage, trace=None):
+        return _Timed(self, stage, trace)
+
+    def maybe_report(self, extra=None):
+        now = time.time()
+        if not self.report_every or now - self._last_report < self.report_every:
+            return
+        with self._lock:
+            samples, self._samples = self._samples, {}
+            self._last_report = now
+        parts = []
+        for stage, vals in samples.items():
+            vals.sort()
+            avg = sum(vals) / len(vals)
+            p95 = vals[min(len(vals) - 1, int(len(vals) * 0.95))]
+            parts.append(f"{stage}={avg * 1000:.1f}/{p95 * 1000:.1f}ms(n={len(vals)})")
+        if extra:
+            parts += [f"{k}={v}" for k, v in extra.items()]
+        print(f"STAGE LATENCY avg/p95 [{self.name}]:", " ".join(parts))
+
+
+class _Timed:
+    __slots__ = ("timer", "stage", "trace", "t0")
+
+    def __init__(self, timer, stage, trace=None):
+        self.timer, self.stage, self.trace = timer, stage, trace
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        self.timer.add(self.stage, dt)
+        if self.trace is not None:
+            self.trace.add(self.stage, self.t0, dt)
+
+
+class FrameAnalyzer:
+    """Per-session detect -> identify -> behavior logic for one camera frame.
+
+    With `remote` (a procpool.RemoteAnalysis) detection, tracking and the
+    behavior rules run in a worker process; only identification stays here.
+    """
+
+    def __init__(self, session_id, detector, embedder, gallery,
+                 det_size=None, det_interval=None, timer=None, remote=None):
+        self.session_id = session_id
+        self.detector = detector
+        self.embedder = embedder
+        self.gallery = gallery
+        self.remote = remote
+        # per-session speed/accuracy trade-off for weak hardware
+        self.img_size = det_size_for(det_size)
+        self.tracker = FaceTracker(interval=det_interval or DET_INTERVAL)
+        self.identities = IdentityCache()
+        # eye/sleep timers, keyed by student once identified, else by track
+        self.behavior_state = BehaviorStateStore()
+        self.timer = timer or StageTimer()
+        self.last_saved = {}
+
+    def reset(self):
+        self.behavior_state.reset()
+        self.identities.entries.clear()
+        self.last_saved.clear()
+        if self.remote is not None:
+            self.remote.reset()
+
+    def warm(self):
+        """Build this room's FaceMesh graphs before the first frame (local mode;
+        process workers keep warmed sets ready for new rooms)."""
+        if self.remote is None:
+            self.behavior_state.meshes.warm()
+        return self
+
+    def _student_keys(self):
+        """track id -> behavior timer key for tracks with a confirmed student."""
+        return {tid: f"s{e.student_id}" for tid, e in self.identities.entries.items() if e.accepted}
+
+    def process(self, frame, now=None, detections=None):
+        """Returns (faces, labels, analyses, Behavior row dicts to persist).
+
+        Recorded video passes its own frame time as `now` and, when frames were
+        detected in a batch, that frame's `detections`.
+        """
+        timer = self.timer
+        now = time.time() if now is None else now
+        trace = metrics.TRACER.start("frame", session_id=self.session_id)
+
+        if self.remote is not None:
+            # previous frame's identities key this frame's timers
+            with timer.time("remote", trace):
+                result = self.remote.process(frame, self.img_size, self._student_keys())
+            if result is None:
+                # worker busy or being respawned: skip the frame, keep identities
+                metrics.FRAMES_DROPPED.inc(reason="worker_unavailable")
+                metrics.TRACER.finish(trace, skipped=True)
+                return [], [], [], []
+            faces, analyses, live = result
+            self._identify(frame, faces, live, now, trace)
+        else:
+            # full detection every few frames, tracked boxes in between
+            with timer.time("detect", trace):
+                if detections is not None:
+                    faces = self.tracker.update(detections)
+                else:
+                    faces = self.tracker.step(frame, self.detector, self.img_size)
+            self._identify(frame, faces, self.tracker.tracks, now, trace)
+            # one batched FaceMesh pass per frame, shared by logging and the overlay
+            with timer.time("mesh", trace):
+                keys = self._student_keys()
+                analyses = analyze_faces(frame, faces, [keys.get(f["track_id"]) or face_key(f) for f in faces],
+                                         self.behavior_state, now)
+
+        labels, events = [], []
+        for i, f in enumerate(faces):
+            ident = self.identities.get(f["track_id"])
+            if ident is None or not ident.accepted:
+                labels.append("unknown")
+                continue
+
+            best_id, best_name, best_sim = ident.student_id, ident.name, ident.sim
+            labels.append(f"{best_name} ({best_sim:.2f})")
+            track = self.tracker.get(f["track_id"])
+            if track is not None:
+                track.student_id, track.name, track.sim = best_id, best_name, best_sim
+
+            behavior = analyses[i].behavior
+            if behavior != "attentive":
+                key = (best_id, behavior)
+                if key not in self.last_saved or (now - self.last_saved[key]) > SAVE_INTERVAL:
+                    events.append({
+                        "session_id": self.session_id,
+                        "student_id": best_id,
+                        "behavior": behavior,
+                        "confidence": float(best_sim),
+                        "timestamp": datetime.utcfromtimestamp(now),
+                    })
+                    self.last_saved[key] = now
+
+        metrics.FRAMES.inc()
+        metrics.FACES_PER_FRAME.observe(len(faces))
+        metrics.TRACER.finish(trace, faces=len(faces), events=len(events))
+        return faces, labels, analyses, events
+
+    def _identify(self, frame, faces, live_ids, now, trace=None):
+        """Recognition only for new, expired, swapped or still-unknown tracks."""
+        self.identities.prune(live_ids)
+        for f in faces:
+            e = self.identities.get(f["track_id"])
+            if e is not None and e.accepted:
+                self.identities.check_appearance(f["track_id"], appearance_signature(frame, f["bbox"]))
+        todo = [i for i, f in enumerate(faces) if self.identities.needs_match(f["track_id"], now)]
+        crops = {i: preprocess_face(frame, faces[i]["bbox"]) for i in todo}
+        valid = [i for i in todo if crops[i] is not None]
+        if valid:
+            with self.timer.time("embed", trace):
+                embs = self.embedder.embed_many([crops[i] for i in valid])
+            with self.timer.time("match", trace):
+                matches = self.gallery.match(list(embs))
+            for i, m in zip(valid, matches):
+                _, _, best_sim, second_sim = m
+                accepted = (m[0] is not None and best_sim >= self.embedder.min_sim
+                            and (best_sim - second_sim) >= self.embedder.min_margin)
+                self.identities.put(faces[i]["track_id"], m, accepted, now,
+                                    appearance_signature(frame, faces[i]["bbox"]) if accepted else None)
+
+
+class StreamPipeline:
+    """Capture, inference and annotate/encode on separate threads.
+
+    Stages are linked by LatestQueue(1) so a slow stage drops stale frames
+    instead of building up latency; behavior rows are handed to the shared
+    BehaviorWriter (backend/writer.py) for batched persistence.
+    """
+
+    def __init__(self, cap, analyzer, writer, name="stream", max_fps=None, live=True,
+                 out_width=None, jpeg_quality=None):
+        self.cap = cap
+        # per-room frame-rate cap; live cameras drop extra frames, files are paced
+        self.max_fps = max_fps
+        self.live = live
+        self.rate_dropped = 0
+        self.analyzer = analyzer
+        self.writer = writer
+        self.timer = analyzer.timer
+        self.timer.name = name
+        self.frames = LatestQueue(1)
+        self.results = LatestQueue(1)
+        # output stream size/quality, shared by every viewer of this camera
+        self.out_width = out_width or STREAM_WIDTH
+        self.hub = FrameHub(jpeg_quality or JPEG_QUALITY)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target in (self._capture, self._infer, self._encode):
+            t = threading.Thread(target=target, name=f"{self.timer.name}-{target.__name__[1:]}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for q in (self.frames, self.results, self.hub):
+            q.close()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout=5)
+        self.cap.release()
+        self.analyzer.reset()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set() or self.hub.closed
+
+    def __iter__(self):
+        """Encoded JPEG frames until the camera ends or stop() is called."""
+        return self.hub.frames()
+
+    def stream(self, max_fps=None, adaptive=False):
+        """Like iter(), with a per-viewer frame-rate cap and adaptive quality/rate."""
+        return self.hub.frames(max_fps=max_fps, adaptive=adaptive)
+
+    # ---- stages --------------------------------------------------------------
+
+    def _capture(self):
+        try:
+            self._capture_loop()
+        except Exception as e:
+            self._failed("capture", e)
+        finally:
+            self.frames.close()
+
+    def _capture_loop(self):
+        min_gap = 1.0 / self.max_fps if self.max_fps else 0.0
+        last = 0.0
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            now = time.perf_counter()
+            self.timer.add("capture", now - t0)
+            if min_gap and now - last < min_gap:
+                if self.live:
+                    self.rate_dropped += 1
+                    metrics.FRAMES_DROPPED.inc(reason="rate")
+                    continue
+                time.sleep(min_gap - (now - last))
+                now = time.perf_counter()
+            last = now
+            if self.frames.put(frame):
+                metrics.FRAMES_DROPPED.inc(reason="inference_busy")
+
+    def _infer(self):
+        try:
+            self._infer_loop()
+        except Exception as e:
+            self._failed("inference", e)
+        finally:
+            self.results.close()
+
+    def _infer_loop(self):
+        while not self._stop.is_set():
+            frame = self.frames.get(timeout=0.5)
+            if frame is None:
+                if self.frames.closed:
+                    break
+                continue
+            with self.timer.time("inference"), profiler.frame():
+                faces, labels, analyses, events = self.analyzer.process(frame)
+            profiler.note_faces(len(faces))
+            for row in events:
+                self.writer.put(row)
+            if self.results.put((frame, faces, labels, analyses)):
+                metrics.FRAMES_DROPPED.inc(reason="encode_busy")
+            self.timer.maybe_report({
+                "dropped_rate": self.rate_dropped,
+                "dropped_capture": self.frames.dropped,
+                "dropped_encode": self.results.dropped,
+                "skipped_client": self.hub.skipped,
+            })
+
+    def _encode(self):
+        try:
+            self._encode_loop()
+        except Exception as e:
+            self._failed("encode", e)
+        finally:
+            # ends every viewer's stream; the broker then tears the producer down
+            self.hub.close()
+
+    def _encode_loop(self):
+        while not self._stop.is_set():
+            item = self.results.get(timeout=0.5)
+            if item is None:
+                if self.results.closed:
+                    break
+                continue
+            if not self.hub.has_viewers:
+                continue  # lingering producer, nobody to send to
+            frame, faces, labels, analyses = item
+            with self.timer.time("encode"):
+                # annotate in place: the frame is not used after this stage
+                draw_boxes(frame, faces, labels, analyses)
+                h, w = frame.shape[:2]
+                if self.out_width and w > self.out_width:
+                    frame = cv2.resize(frame, (self.out_width, max(1, h * self.out_width // w)),
+                                       interpolation=cv2.INTER_AREA)
+                ret, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.hub.jpeg_quality()])
+            if ret:
+                self.hub.publish(buf.tobytes())
+
+    def _failed(self, stage, e):
+        """A stage died: log it and stop the other stages so the stream ends."""
+        metrics.PIPELINE_ERRORS.inc(stage=stage)
+        print(f"[{self.timer.name}] {stage} stage failed:", repr(e))
+        traceback.print_exc()
+        self._stop.set()
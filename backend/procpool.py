@@ -0,0 +1,303 @@
+import os, queue, threading, itertools, time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+import numpy as np
+
+from backend import metrics
+
+# >0 runs detection + behavior analysis in this many worker processes
+PROCESS_WORKERS = int(os.getenv("SANAD_PROCESS_WORKERS", "0"))
+SHM_SLOTS = int(os.getenv("SANAD_SHM_SLOTS", "16"))
+# largest frame a slot holds (WIDTHxHEIGHT); bigger frames are downscaled
+SHM_FRAME = os.getenv("SANAD_SHM_FRAME", "1280x720")
+RESULT_TIMEOUT = 10.0  # seconds before a frame is given up on (dead worker)
+LIVENESS_INTERVAL = 1.0  # seconds between worker is_alive() checks
+
+
+class WorkerLost(RuntimeError):
+    """The worker process handling a frame died before answering."""
+
+
+def _parse_size(value):
+    w, h = value.lower().split("x")
+    return int(h), int(w)
+
+
+class FrameRing:
+    """Fixed-size BGR frame slots in one SharedMemory block.
+
+    Frames are copied in by the API process and read in place by workers; only
+    (slot, height, width) crosses the task queue. Each frame is stored
+    contiguously at the start of its slot, so workers get a plain array.
+    """
+
+    def __init__(self, slots, height, width, name=None):
+        self.slots, self.height, self.width = slots, height, width
+        self.slot_bytes = height * width * 3
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None,
+                                              size=slots * self.slot_bytes)
+        self.owner = name is None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def view(self, slot, h, w):
+        return np.ndarray((h, w, 3), dtype=np.uint8, buffer=self.shm.buf,
+                          offset=slot * self.slot_bytes)
+
+    def write(self, slot, frame):
+        """Copy `frame` into `slot`; returns (h, w, scale) of what was stored."""
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.height / h, self.width / w)
+        if scale < 1.0:
+            import cv2
+            h, w = int(h * scale), int(w * scale)
+            cv2.resize(frame, (w, h), dst=self.view(slot, h, w), interpolation=cv2.INTER_AREA)
+        else:
+            self.view(slot, h, w)[:] = frame
+        return h, w, scale
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker_main(index, shm_name, slots, height, width, tasks, results, detector_kwargs):
+    # heavy imports happen here, in the spawned process only
+    from backend.detection import FaceDetector
+    from backend.tracking import FaceTracker
+    from backend.behavior import BehaviorStateStore, analyze_faces, face_key
+    from backend.runtime import warm_up
+
+    ring = FrameRing(slots, height, width, name=shm_name)
+    detector = FaceDetector(**detector_kwargs)
+    results.put(("ready", index, warm_up(detector)))
+    rooms = {}  # room -> (FaceTracker, BehaviorStateStore)
+    # a store with warmed FaceMesh graphs for the next new room; refilled while idle
+    spare = BehaviorStateStore()
+    spare.meshes.warm()
+    try:
+        while True:
+            try:
+                msg = tasks.get(timeout=1.0)
+            except queue.Empty:
+                if spare is None:
+                    spare = BehaviorStateStore()
+                    spare.meshes.warm()
+                continue
+            if msg is None:
+                break
+            if msg[0] == "drop":
+                dropped = rooms.pop(msg[1], None)
+                if dropped is not None:
+                    dropped[1].reset()  # closes the room's FaceMesh graphs
+                continue
+            _, job_id, room, slot, h, w, img_size, interval, keys = msg
+            try:
+                if room not in rooms:
+                    rooms[room] = (FaceTracker(interval=interval), spare or BehaviorStateStore())
+                    spare = None
+                tracker, store = rooms[room]
+                frame = ring.view(slot, h, w)
+                t0 = time.perf_counter()
+                faces = tracker.step(frame, detector, img_size)
+                t1 = time.perf_counter()
+                analyses = analyze_faces(frame, faces,
+                                         [keys.get(f["track_id"]) or face_key(f) for f in faces], store)
+                t2 = time.perf_counter()
+                rows = [tuple(getattr(a, k) for k in a.__slots__) for a in analyses]
+                # stage seconds travel with the result, the API process exports them
+                stages = (("detect", t1 - t0), ("mesh", t2 - t1))
+                results.put((job_id, faces, rows, list(tracker.tracks), stages, None))
+            except Exception as e:
+                results.put((job_id, None, None, None, (), f"worker {index}: {e!r}"))
+    finally:
+        ring.shm.close()
+
+
+class ProcessInferencePool:
+    """Detector, tracker and FaceMesh analysis in worker processes.
+
+    Alternative to InferencePool for when inference should not share the API
+    process's GIL. Frames go through a FrameRing; each room sticks to one
+    worker (which keeps its tracker and behavior timers) and gets back only
+    the compact faces/analysis results over a queue.
+    """
+
+    def __init__(self, workers=PROCESS_WORKERS, slots=SHM_SLOTS, frame_size=SHM_FRAME,
+                 detector_kwargs=None):
+        self.workers = max(1, workers)
+        height, width = _parse_size(frame_size)
+        self.ring = FrameRing(max(self.workers, slots), height, width)
+        self._free = queue.Queue()
+        for i in range(self.ring.slots):
+            self._free.put(i)
+        self._ctx = mp.get_context("spawn")  # no forking a process that holds torch/mediapipe threads
+        self._args = (self.ring.name, self.ring.slots, height, width)
+        self._detector_kwargs = detector_kwargs or {}
+        self._results = self._ctx.Queue()
+        self._tasks = [None] * self.workers
+        self._procs = [None] * self.workers
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> (Future, slot, scale, worker index)
+        self._rooms = {}  # room -> worker index
+        self._ids = itertools.count()
+        self.ready = {}  # worker index -> warm-up ms, filled as workers come up
+        self.failed = {}  # worker index -> why it died before becoming ready (not respawned)
+        self.restarts = 0
+        self._closing = False
+        self._collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+        self.frames = 0
+
+    def start(self):
+        for i in range(self.workers):
+            self._spawn(i)
+        self._collector.start()
+        return self
+
+    def _spawn(self, i):
+        # a fresh task queue: whatever the dead worker left unread is failed, not replayed
+        self._tasks[i] = self._ctx.Queue()
+        self._procs[i] = self._ctx.Process(
+            target=_worker_main, name=f"inference-{i}", daemon=True,
+            args=(i, *self._args, self._tasks[i], self._results, self._detector_kwargs))
+        self._procs[i].start()
+
+    def submit(self, room, frame, img_size, interval, keys) -> Future:
+        fut = Future()
+        try:
+            slot = self._free.get(timeout=RESULT_TIMEOUT)
+        except queue.Empty:
+            fut.set_exception(TimeoutError("no free frame slot"))
+            return fut
+        h, w, scale = self.ring.write(slot, frame)
+        with self._lock:
+            worker = self._worker_for(room)
+            if worker is None:
+                self._free.put(slot)
+                fut.set_exception(WorkerLost("no inference worker running"))
+                return fut
+            job_id = next(self._ids)
+            self._jobs[job_id] = (fut, slot, scale, worker)
+            # under the lock so a respawn cannot swap the queue in between
+            self._tasks[worker].put(("frame", job_id, room, slot, h, w, img_size, interval, keys))
+        return fut
+
+    def _worker_for(self, room):
+        if room not in self._rooms:
+            load = {i: 0 for i in range(self.workers) if i not in self.failed}
+            if not load:
+                return None
+            for w in self._rooms.values():
+                load[w] += 1
+            self._rooms[room] = min(load, key=load.get)
+        return self._rooms[room]
+
+    def drop_room(self, room):
+        with self._lock:
+            worker = self._rooms.pop(room, None)
+        if worker is not None:
+            self._tasks[worker].put(("drop", room))
+
+    def client_for(self, room, interval):
+        return RemoteAnalysis(self, room, interval)
+
+    def close(self):
+        self._closing = True
+        for q in self._tasks:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=5)
+        self.ring.close()
+
+    def _check_workers(self):
+        """Fail the frames of dead workers, free their slots and respawn them.
+
+        A worker that dies before reporting "ready" (bad model path, out of
+        memory at load) is not respawned; its rooms move to the others.
+        """
+        for i, p in enumerate(self._procs):
+            if self._closing or i in self.failed or p.is_alive():
+                continue
+            with self._lock:
+                lost = [(jid, job) for jid, job in self._jobs.items() if job[3] == i]
+                for jid, _ in lost:
+                    del self._jobs[jid]
+                if i in self.ready:
+                    del self.ready[i]
+                    self.restarts += 1
+                    self._spawn(i)
+                else:
+                    self.failed[i] = f"worker {i} exited with code {p.exitcode} while loading"
+                    self._rooms = {r: w for r, w in self._rooms.items() if w != i}
+            for _, (fut, slot, _, _) in lost:
+                self._free.put(slot)
+                fut.set_exception(WorkerLost(f"worker {i} exited with code {p.exitcode}"))
+
+    def _collect(self):
+        from backend.behavior import FaceAnalysis
+        checked = time.monotonic()
+        while True:
+            try:
+                msg = self._results.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                msg = ()
+            if time.monotonic() - checked >= LIVENESS_INTERVAL:
+                self._check_workers()
+                checked = time.monotonic()
+            if msg == ():
+                continue
+            if msg is None:
+                return
+            if msg[0] == "ready":
+                self.ready[msg[1]] = msg[2]
+                continue
+            job_id, faces, rows, live, stages, err = msg
+            for stage, seconds in stages:
+                metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+            with self._lock:
+                job = self._jobs.pop(job_id, None)
+            if job is None:
+                continue
+            fut, slot, scale, _ = job
+            self._free.put(slot)
+            if err is not None:
+                fut.set_exception(RuntimeError(err))
+                continue
+            if scale != 1.0:
+                for f in faces:
+                    f["bbox"] = [int(round(v / scale)) for v in f["bbox"]]
+                    f["landmarks"] = [(x / scale, y / scale) for x, y in f["landmarks"]]
+            self.frames += 1
+            fut.set_result((faces, [FaceAnalysis(*r) for r in rows], set(live)))
+
+
+class RemoteAnalysis:
+    """One room's handle on a ProcessInferencePool (see FrameAnalyzer)."""
+
+    def __init__(self, pool, room, interval):
+        self.pool = pool
+        self.room = room
+        self.interval = interval
+
+    def process(self, frame, img_size, keys):
+        """(faces, analyses, live track ids) for one frame; keys maps track id -> timer key.
+
+        None when the frame was skipped: no free slot, a timeout or a worker
+        that died (and is being respawned).
+        """
+        fut = self.pool.submit(self.room, frame, img_size, self.interval, keys)
+        try:
+            return fut.result(timeout=RESULT_TIMEOUT)
+        except (TimeoutError, WorkerLost):
+            return None
+
+    def reset(self):
+        self.pool.drop_room(self.room)
@@ -0,0 +1,204 @@
+import os, sys, io, time, threading, cProfile, pstats, marshal
+from collections import Counter
+from contextlib import nullcontext, contextmanager
+
+MAX_SECONDS = 60.0
+MODES = ("collapsed", "pstats", "prof")
+# threads worth profiling: stream stages (StreamPipeline names them
+# "session-<id>-<stage>") and the shared InferencePool detectors
+PIPELINE_PREFIX = "session-"
+DETECTOR_PREFIX = "detector-"
+
+_lock = threading.Lock()
+_active = None  # the running ProfileRun; None keeps the hooks below no-ops
+_NOOP = nullcontext()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class ProfileRun:
+    """One /debug/profile capture.
+
+    "collapsed" samples the stacks of the stream and detector threads every
+    `interval` seconds (sys._current_frames, so no signals and no cost to the
+    sampled threads); "pstats"/"prof" run cProfile around each analyzed frame
+    of the stream inference threads and each detector batch. With a
+    `thread_prefix` ("session-<id>-") only that session's threads are kept,
+    and detector threads only while their batch holds one of its frames.
+    Stream stacks are annotated with face counts, detector stacks with the
+    rooms of their batch.
+    """
+
+    def __init__(self, mode="collapsed", seconds=10.0, interval=0.005, thread_prefix=""):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.mode = mode
+        self.seconds = max(0.1, min(MAX_SECONDS, seconds))
+        self.interval = max(0.001, interval)
+        self.thread_prefix = thread_prefix
+        self.stacks = Counter()
+        self.samples = 0
+        self.faces = []  # face count of every frame analyzed during the run
+        self.current = {}  # thread ident -> face count of its latest frame
+        self.busy = {}  # detector thread ident -> rooms of the batch it is running
+        self._profiles = {}  # thread ident -> cProfile.Profile
+
+    # ---- hooks called from the inference threads -----------------------------
+
+    def _wanted(self):
+        return threading.current_thread().name.startswith(self.thread_prefix)
+
+    def _wants_rooms(self, rooms):
+        return any(f"{PIPELINE_PREFIX}{r}-".startswith(self.thread_prefix) for r in rooms)
+
+    def _profile(self):
+        ident = threading.get_ident()
+        prof = self._profiles.get(ident)
+        if prof is None:
+            prof = self._profiles[ident] = cProfile.Profile()
+        return prof
+
+    def frame(self):
+        if self.mode == "collapsed" or not self._wanted():
+            return _NOOP
+        return self._profile()
+
+    @contextmanager
+    def batch(self, rooms):
+        if not self._wants_rooms(rooms):
+            yield
+            return
+        ident = threading.get_ident()
+        self.busy[ident] = rooms
+        try:
+            with (_NOOP if self.mode == "collapsed" else self._profile()):
+                yield
+        finally:
+            self.busy.pop(ident, None)
+
+    def note_faces(self, n):
+        if not self._wanted():
+            return
+        self.faces.append(n)
+        self.current[threading.get_ident()] = n
+
+    # ---- capture -------------------------------------------------------------
+
+    def run(self):
+        global _active
+        if not _lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running")
+        try:
+            _active = self
+            if self.mode == "collapsed":
+                self._sample(time.perf_counter() + self.seconds)
+            else:
+                time.sleep(self.seconds)
+        finally:
+            _active = None
+            _lock.release()
+        return self
+
+    def _sample(self, deadline):
+        me = threading.get_ident()
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == me:
+                    continue
+                if name.startswith(DETECTOR_PREFIX):
+                    rooms = self.busy.get(ident)
+                    if rooms is None and self.thread_prefix:
+                        continue  # idle, or busy with other sessions' frames
+                    root = [name] + ([f"rooms={','.join(map(str, rooms))}"] if rooms else [])
+                elif name.startswith(self.thread_prefix or PIPELINE_PREFIX):
+                    root = [name]
+                    if ident in self.current:
+                        root.append(f"faces={self.current[ident]}")
+                else:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(root + stack[::-1])] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    # ---- artifacts -----------------------------------------------------------
+
+    def summary(self):
+        f = self.faces
+        return {
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "samples": self.samples,
+            "frames": len(f),
+            "faces_mean": round(sum(f) / len(f), 2) if f else 0.0,
+            "faces_max": max(f) if f else 0,
+            "faces_histogram": dict(sorted(Counter(f).items())),
+        }
+
+    def _stats(self):
+        # snapshot without create_stats(): that would call disable() from this
+        # thread while a frame may still be profiling on its own
+        profs = [_Snapshot(p) for p in self._profiles.values()]
+        if not profs:
+            return None
+        st = pstats.Stats(profs[0])
+        for p in profs[1:]:
+            st.add(p)
+        return st
+
+    def collapsed(self):
+        """Brendan Gregg's folded format (flamegraph.pl, speedscope), summary as # lines."""
+        head = [f"# {k}: {v}" for k, v in self.summary().items()]
+        return "\n".join(head + [f"{s} {n}" for s, n in self.stacks.most_common()]) + "\n"
+
+    def pstats_text(self, limit=60):
+        out = io.StringIO()
+        for k, v in self.summary().items():
+            out.write(f"# {k}: {v}\n")
+        st = self._stats()
+        if st is not None:
+            st.stream = out
+            st.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def prof_bytes(self):
+        """Binary pstats dump, loadable with pstats.Stats / snakeviz."""
+        st = self._stats()
+        return marshal.dumps(st.stats if st is not None else {})
+
+
+class _Snapshot:
+    __slots__ = ("prof", "stats")
+
+    def __init__(self, prof):
+        self.prof = prof
+
+    def create_stats(self):
+        self.prof.snapshot_stats()
+        self.stats = self.prof.stats
+
+
+def frame():
+    """Context manager around one analyzed frame; no-op unless cProfile is on."""
+    run = _active
+    return run.frame() if run is not None else _NOOP
+
+
+def batch(rooms):
+    """Context manager around one InferencePool detector batch for `rooms`."""
+    run = _active
+    return run.batch(rooms) if run is not None else _NOOP
+
+
+def note_faces(n):
+    run = _active
+    if run is not None:
+        run.note_faces(n)
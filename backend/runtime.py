@@ -0,0 +1,133 @@
+import os, sys, threading, time
+import numpy as np
+
+from backend.inference import InferencePool
+from backend.procpool import ProcessInferencePool, PROCESS_WORKERS
+
+# load + warm the vision stack in the background at startup instead of on the
+# first stream; /ready then reports 503 until it is done
+PRELOAD = os.getenv("SANAD_PRELOAD_MODELS", "0") == "1"
+
+
+def warm_up(detector=None, embedder=None, img_size=None):
+    """Run a dummy frame through each model; returns the time taken in ms.
+
+    The first real frame otherwise pays for lazy imports, kernel selection
+    and allocator growth. FaceMesh graphs are per room, so the ones built
+    here are closed again; each stream warms its own (FrameAnalyzer.warm).
+    """
+    from backend.behavior import BehaviorStateStore, analyze_faces
+    from backend.tracking import det_size_for
+
+    t0 = time.perf_counter()
+    frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    if detector is not None:
+        detector.predict(frame, img_size=det_size_for(img_size))
+    face = {"bbox": [220, 140, 420, 340], "conf": 1.0, "track_id": 0,
+            "landmarks": [(280, 210), (360, 210), (320, 250), (290, 300), (350, 300)]}
+    store = BehaviorStateStore()
+    analyze_faces(frame, [face], store=store)
+    store.reset()
+    if embedder is not None:
+        embedder.embed(frame[140:252, 220:332])
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+
+class VisionRuntime:
+    """Lazily created inference backend shared by all streams.
+
+    Nothing heavy (torch, yolov5-face, mediapipe) is imported until the first
+    stream calls ensure(), so API-only workers and reloads start fast. Either
+    an in-process InferencePool or, with SANAD_PROCESS_WORKERS, a
+    ProcessInferencePool is created, and every detector is warmed up first.
+    """
+
+    def __init__(self, embedder_factory=None, process_workers=PROCESS_WORKERS):
+        self.embedder_factory = embedder_factory
+        self.process_workers = process_workers
+        self.inference_pool = None
+        self.process_pool = None
+        self.state = "not_loaded"
+        self.error = None
+        self.load_seconds = None
+        self.warmup_ms = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.status()["state"] == "ready"
+
+    def ensure(self):
+        """Load on first use; raises RuntimeError when loading failed."""
+        if self.state != "ready":
+            with self._lock:
+                if self.state != "ready":
+                    self._load()
+        if self.state == "failed":
+            raise RuntimeError(self.error)
+        return self
+
+    def load_async(self):
+        threading.Thread(target=self._load_quietly, name="model-loader", daemon=True).start()
+
+    def _load_quietly(self):
+        try:
+            self.ensure()
+        except RuntimeError as e:
+            print("model load failed:", e)
+
+    def _load(self):
+        self.state, self.error = "loading", None
+        t0 = time.perf_counter()
+        try:
+            if self.process_workers > 0:
+                # workers load and warm up in their own processes, see procpool
+                self.process_pool = ProcessInferencePool(self.process_workers).start()
+            else:
+                from backend.detection import FaceDetector
+                warm = []
+                embedder = self.embedder_factory() if self.embedder_factory else None
+
+                def factory():
+                    detector = FaceDetector()
+                    warm.append(warm_up(detector, embedder))
+                    return detector
+
+                self.inference_pool = InferencePool(factory)
+                self.warmup_ms = max(warm)
+            self.state = "ready"
+        except Exception as e:
+            self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+        self.load_seconds = round(time.perf_counter() - t0, 2)
+
+    def status(self):
+        st = {
+            "state": self.state,
+            "backend": "processes" if self.process_workers > 0 else "threads",
+            "load_seconds": self.load_seconds,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error,
+            "torch_imported": "torch" in sys.modules,
+            "mediapipe_imported": "mediapipe" in sys.modules,
+        }
+        pool = self.process_pool
+        if pool is not None:
+            st["workers_ready"] = len(pool.ready)
+            st["workers"] = pool.workers
+            st["warmup_ms"] = max(pool.ready.values(), default=None)
+            st["worker_restarts"] = pool.restarts
+            if pool.failed:
+                # workers that died while loading are not waited for
+                st["workers_failed"] = len(pool.failed)
+                st["error"] = "; ".join(pool.failed.values())
+            if self.state == "ready" and len(pool.failed) == pool.workers:
+                st["state"] = "failed"
+            elif self.state == "ready" and len(pool.ready) + len(pool.failed) < pool.workers:
+                st["state"] = "loading"
+        return st
+
+    def close(self):
+        if self.inference_pool is not None:
+            self.inference_pool.close()
+        if self.process_pool is not None:
+            self.process_pool.close()
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from backend.db_models import Behavior, BehaviorSummary, Session as DBSession, Student
+
+summary = BehaviorSummary.__table__
+
+# group_by values accepted by /behaviors/summary and the columns they map to
+GROUP_COLUMNS = {
+    "session": lambda: DBSession.id.label("session_id"),
+    "student": lambda: Student.id.label("student_id"),
+    "class": lambda: Student.class_name.label("class_name"),
+    "behavior": lambda: BehaviorSummary.behavior.label("behavior"),
+    "day": lambda: func.date(DBSession.start_time).label("day"),
+    # Monday of the ISO week ("weekday 0" moves to that week's Sunday);
+    # %Y-W%W splits a week at New Year and %G-W%V needs SQLite >= 3.46
+    "week": lambda: func.date(DBSession.start_time, "weekday 0", "-6 days").label("week"),
+    "exam": lambda: DBSession.is_exam.label("is_exam"),
+}
+
+
+def apply_rows(conn, rows):
+    """Fold freshly inserted Behavior rows (dicts) into the summary table."""
+    groups = defaultdict(lambda: [0, None, None])
+    for r in rows:
+        g = groups[(r["session_id"], r["student_id"], r["behavior"])]
+        g[0] += 1
+        ts = r.get("timestamp")
+        if ts is not None:
+            g[1] = ts if g[1] is None else min(g[1], ts)
+            g[2] = ts if g[2] is None else max(g[2], ts)
+    if not groups:
+        return
+    values = [
+        {"session_id": k[0], "student_id": k[1], "behavior": k[2],
+         "count": n, "first_seen": first, "last_seen": last}
+        for k, (n, first, last) in groups.items()
+    ]
+    stmt = sqlite_insert(summary)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id", "student_id", "behavior"],
+        set_={
+            "count": summary.c.count + stmt.excluded.count,
+            # SQLite's scalar min/max return NULL if either side is NULL
+            "first_seen": func.coalesce(func.min(summary.c.first_seen, stmt.excluded.first_seen),
+                                        summary.c.first_seen, stmt.excluded.first_seen),
+            "last_seen": func.coalesce(func.max(summary.c.last_seen, stmt.excluded.last_seen),
+                                       summary.c.last_seen, stmt.excluded.last_seen),
+        },
+    )
+    conn.execute(stmt, values)
+
+
+def rebuild(conn, session_id=None):
+    """Recompute summaries from the raw events (one session, or all of them)."""
+    d = delete(summary)
+    src = select(
+        Behavior.session_id, Behavior.student_id, Behavior.behavior,
+        func.count(), func.min(Behavior.timestamp), func.max(Behavior.timestamp),
+    ).group_by(Behavior.session_id, Behavior.student_id, Behavior.behavior)
+    if session_id is not None:
+        d = d.where(summary.c.session_id == session_id)
+        src = src.where(Behavior.session_id == session_id)
+    conn.execute(d)
+    conn.execute(insert(summary).from_select(
+        ["session_id", "student_id", "behavior", "count", "first_seen", "last_seen"], src
+    ))
+
+
+def query(db, group_by, session_id=None, student_id=None, class_name=None,
+          behavior=None, date_from=None, date_to=None, parent_id=None):
+    """Summed counts grouped by any of GROUP_COLUMNS; O(groups), not O(events)."""
+    cols = [GROUP_COLUMNS[g]() for g in group_by]
+    q = (
+        db.query(*cols, func.sum(BehaviorSummary.count).label("count"))
+        .select_from(BehaviorSummary)
+        .join(DBSession, DBSession.id == BehaviorSummary.session_id)
+        .join(Student, Student.id == BehaviorSummary.student_id)
+    )
+    if session_id is not None:
+        q = q.filter(BehaviorSummary.session_id == session_id)
+    if student_id is not None:
+        q = q.filter(BehaviorSummary.student_id == student_id)
+    if class_name:
+        q = q.filter(Student.class_name == class_name)
+    if behavior:
+        q = q.filter(BehaviorSummary.behavior.in_(behavior))
+    if date_from:
+        q = q.filter(DBSession.start_time >= date_from)
+    if date_to:
+        q = q.filter(DBSession.start_time < date_to)
+    if parent_id is not None:
+        q = q.filter(Student.parent_id == parent_id)
+    if cols:
+        q = q.group_by(*cols).order_by(*cols)
+    return [dict(r._mapping) for r in q.all()]
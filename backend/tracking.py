@@ -0,0 +1,215 @@
+import os
+from typing import Dict, List
+
+DET_INTERVAL = int(os.getenv("SANAD_DET_INTERVAL", "5"))
+DET_SIZE = int(os.getenv("SANAD_DET_SIZE", "640"))
+# seconds a confirmed identity is trusted before the track is matched again
+REID_TTL = float(os.getenv("SANAD_REID_TTL", "10"))
+# seconds between retries for tracks that have no confident match yet
+REID_RETRY = float(os.getenv("SANAD_REID_RETRY", "1"))
+# min correlation between a confirmed track's face now and when it was matched;
+# below it (e.g. two students swapped tracks) the track is matched again
+REID_APPEARANCE = float(os.getenv("SANAD_REID_APPEARANCE", "0.4"))
+
+
+def det_size_for(value=None):
+    """Detector input size rounded to the model stride (32) and sane bounds."""
+    size = int(value or DET_SIZE)
+    return max(160, min(1280, size // 32 * 32))
+
+
+def bbox_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    __slots__ = ("id", "bbox", "det_bbox", "det_frame", "conf", "landmarks", "velocity",
+                 "since_det", "misses", "student_id", "name", "sim")
+
+    def __init__(self, track_id, det, frame=0):
+        self.id = track_id
+        self.bbox = [float(v) for v in det["bbox"]]
+        # last detector box and tracker frame it came from; velocity is measured
+        # between detections, never against the propagated box
+        self.det_bbox = self.bbox
+        self.det_frame = frame
+        self.conf = det.get("conf", 1.0)
+        self.landmarks = list(det.get("landmarks", []))
+        self.velocity = [0.0, 0.0, 0.0, 0.0]  # per frame, x1 y1 x2 y2
+        self.since_det = 0
+        self.misses = 0
+        # identification result for this track (see gen_frames)
+        self.student_id = None
+        self.name = "unknown"
+        self.sim = -1.0
+
+    def confidence(self, decay):
+        return self.conf * (decay ** self.since_det)
+
+    def as_face(self):
+        return {
+            "bbox": [int(round(v)) for v in self.bbox],
+            "conf": self.conf,
+            "landmarks": self.landmarks,
+            "track_id": self.id,
+        }
+
+
+class FaceTracker:
+    """IoU tracker that lets the detector run only every `interval` frames.
+
+    Between detections boxes are moved with a constant-velocity estimate and
+    their confidence decays; a detection is forced early once any track falls
+    below `min_conf`, which sits under the detector's conf_thres (0.25) so a
+    weak but fresh detection does not force detection on every frame.
+    """
+
+    def __init__(self, interval=DET_INTERVAL, iou_thres=0.3, max_misses=2,
+                 decay=0.97, min_conf=0.2):
+        self.interval = max(1, int(interval))
+        self.iou_thres = iou_thres
+        self.max_misses = max_misses
+        self.decay = decay
+        self.min_conf = min_conf
+        self.tracks: Dict[int, Track] = {}
+        self._next_id = 1
+        self._since_det = None
+        self._frame = 0
+
+    def get(self, track_id):
+        return self.tracks.get(track_id)
+
+    def needs_detection(self):
+        if self._since_det is None or self._since_det + 1 >= self.interval:
+            return True
+        return any(t.confidence(self.decay) < self.min_conf for t in self.tracks.values())
+
+    def update(self, detections) -> List[dict]:
+        """Feed fresh detector output; returns faces tagged with track_id."""
+        self._frame += 1
+        self._since_det = 0
+
+        pairs = sorted(
+            ((bbox_iou(t.bbox, d["bbox"]), tid, di)
+             for tid, t in self.tracks.items() for di, d in enumerate(detections)),
+            reverse=True,
+        )
+        used_t, used_d = set(), set()
+        for score, tid, di in pairs:
+            if score < self.iou_thres:
+                break
+            if tid in used_t or di in used_d:
+                continue
+            used_t.add(tid); used_d.add(di)
+            t, d = self.tracks[tid], detections[di]
+            new = [float(v) for v in d["bbox"]]
+            frames = self._frame - t.det_frame
+            t.velocity = [0.5 * v + 0.5 * (n - o) / frames
+                          for v, n, o in zip(t.velocity, new, t.det_bbox)]
+            t.bbox = t.det_bbox = new
+            t.det_frame = self._frame
+            t.conf = d.get("conf", 1.0)
+            t.landmarks = list(d.get("landmarks", []))
+            t.since_det = 0
+            t.misses = 0
+
+        for tid in list(self.tracks):
+            if tid not in used_t:
+                t = self.tracks[tid]
+                t.misses += 1
+                if t.misses > self.max_misses:
+                    del self.tracks[tid]
+
+        for di, d in enumerate(detections):
+            if di not in used_d:
+                self.tracks[self._next_id] = Track(self._next_id, d, self._frame)
+                used_t.add(self._next_id)
+                self._next_id += 1
+
+        return [self.tracks[tid].as_face() for tid in sorted(used_t) if tid in self.tracks]
+
+    def propagate(self) -> List[dict]:
+        """Advance every live track one frame without running the detector."""
+        self._frame += 1
+        self._since_det = (self._since_det or 0) + 1
+        faces = []
+        for t in self.tracks.values():
+            if t.misses:
+                continue
+            dx = (t.velocity[0] + t.velocity[2]) / 2
+            dy = (t.velocity[1] + t.velocity[3]) / 2
+            t.bbox = [v + d for v, d in zip(t.bbox, t.velocity)]
+            t.landmarks = [(x + dx, y + dy) for x, y in t.landmarks]
+            t.since_det += 1
+            faces.append(t.as_face())
+        return faces
+
+    def step(self, frame, detector, img_size=None) -> List[dict]:
+        if self.needs_detection():
+            return self.update(detector.predict(frame, img_size=img_size))
+        return self.propagate()
+
+
+class Identity:
+    __slots__ = ("student_id", "name", "sim", "second_sim", "accepted", "appearance",
+                 "checked_at", "expires_at")
+
+    def __init__(self, match, accepted, now, ttl, appearance=None):
+        self.student_id, self.name, self.sim, self.second_sim = match
+        self.accepted = accepted
+        self.appearance = appearance  # helpers.appearance_signature at match time
+        self.checked_at = now
+        self.expires_at = now + ttl
+
+
+class IdentityCache:
+    """Per-session track -> student cache so recognition runs once per track.
+
+    A track is (re)matched when it is new, when its confirmed identity is
+    older than `ttl`, or every `retry` seconds while its last match did not
+    pass the similarity/margin test. Between matches a confirmed track is
+    re-matched early once its face stops correlating with the one it was
+    matched on (check_appearance), so an IoU swap cannot keep a wrong name
+    for a whole `ttl`.
+    """
+
+    def __init__(self, ttl=REID_TTL, retry=REID_RETRY, min_appearance=REID_APPEARANCE):
+        self.ttl = ttl
+        self.retry = retry
+        self.min_appearance = min_appearance
+        self.entries: Dict[int, Identity] = {}
+        self.rematches = 0
+
+    def get(self, track_id):
+        return self.entries.get(track_id)
+
+    def needs_match(self, track_id, now):
+        e = self.entries.get(track_id)
+        if e is None:
+            return True
+        if e.accepted:
+            return now >= e.expires_at
+        return now - e.checked_at >= self.retry
+
+    def put(self, track_id, match, accepted, now, appearance=None):
+        self.entries[track_id] = Identity(match, accepted, now, self.ttl, appearance)
+
+    def check_appearance(self, track_id, appearance):
+        """Drop a confirmed identity whose face no longer matches; False if dropped."""
+        e = self.entries.get(track_id)
+        if e is None or not e.accepted or e.appearance is None or appearance is None:
+            return True
+        if float(e.appearance @ appearance) >= self.min_appearance:
+            return True
+        del self.entries[track_id]
+        self.rematches += 1
+        return False
+
+    def prune(self, live_ids):
+        for tid in list(self.entries):
+            if tid not in live_ids:
+                del self.entries[tid]
@@ -0,0 +1,160 @@
+import os, queue, threading, time
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from backend import summaries
+from backend.db_models import Behavior
+from backend.pipeline import StageTimer
+from backend import metrics
+
+FLUSH_ROWS = int(os.getenv("SANAD_WRITER_FLUSH_ROWS", "100"))
+FLUSH_MS = int(os.getenv("SANAD_WRITER_FLUSH_MS", "500"))
+QUEUE_SIZE = int(os.getenv("SANAD_WRITER_QUEUE", "5000"))
+# attempts per batch on transient errors ("database is locked"), with backoff
+WRITE_RETRIES = int(os.getenv("SANAD_WRITER_RETRIES", "4"))
+RETRY_BACKOFF = 0.1  # seconds, doubled after every failed attempt
+# drops are counted in sanad_db_rows_total; the log line is at most this often
+DROP_LOG_EVERY = 10.0  # seconds
+
+
+class _Flush:
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class BehaviorWriter:
+    """Background batched writer for Behavior rows.
+
+    Producers put plain dicts; one thread holding one long-lived connection
+    bulk-inserts them every `flush_rows` rows or `flush_ms` milliseconds,
+    whichever comes first, and folds them into behavior_summaries in the same
+    transaction. put() never blocks the inference thread: when the bounded
+    queue is full the row is dropped and counted. A batch that hits a
+    transient OperationalError is retried with backoff before it is discarded.
+    """
+
+    def __init__(self, engine, flush_rows=FLUSH_ROWS, flush_ms=FLUSH_MS, maxsize=QUEUE_SIZE):
+        self.engine = engine
+        self.flush_rows = max(1, flush_rows)
+        self.flush_s = flush_ms / 1000.0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._closed = False
+        self.timer = StageTimer("db-writer")
+        self.rows_written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.retries = 0
+        self.last_flush_rows = 0
+        self.last_flush_ms = 0.0
+        self._drop_logged = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="behavior-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            metrics.DB_ROWS.inc(result="dropped")
+            now = time.monotonic()
+            if self._drop_logged is None or now - self._drop_logged >= DROP_LOG_EVERY:
+                self._drop_logged = now
+                print(f"DB writer queue full, {self.dropped} behavior rows dropped so far")
+
+    def flush(self, timeout=10.0):
+        """Block until every row queued before this call is committed.
+
+        False when that did not happen within `timeout` or the writer is not
+        running; the rows may then still be missing from the DB."""
+        if self._thread is None or not self._thread.is_alive():
+            return False
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        self.flush(timeout)
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "last_flush_rows": self.last_flush_rows,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    # ---- writer thread -------------------------------------------------------
+
+    def _run(self):
+        conn = self.engine.connect()
+        pending, markers = [], []
+        deadline = None
+        try:
+            while not (self._closed and self._queue.empty() and not pending):
+                timeout = 0.5 if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                elif item is not None:
+                    pending.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_s
+
+                due = deadline is not None and time.monotonic() >= deadline
+                if pending and (len(pending) >= self.flush_rows or due or markers):
+                    self._write(conn, pending)
+                    pending, deadline = [], None
+                for m in markers:
+                    m.done.set()
+                markers = []
+        finally:
+            conn.close()
+
+    def _write(self, conn, rows):
+        delay = RETRY_BACKOFF
+        for attempt in range(1, WRITE_RETRIES + 1):
+            t0 = time.perf_counter()
+            try:
+                with conn.begin():
+                    conn.execute(insert(Behavior.__table__), rows)
+                    summaries.apply_rows(conn, rows)
+                break
+            except OperationalError as e:
+                # locked/busy DB: the transaction was rolled back, try the batch again
+                if attempt == WRITE_RETRIES:
+                    return self._failed(rows, e)
+                self.retries += 1
+                metrics.DB_ROWS.inc(len(rows), result="retried")
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                return self._failed(rows, e)
+        elapsed = time.perf_counter() - t0
+        metrics.DB_ROWS.inc(len(rows), result="written")
+        self.rows_written += len(rows)
+        self.flushes += 1
+        self.last_flush_rows = len(rows)
+        self.last_flush_ms = elapsed * 1000
+        self.timer.add("db_flush", elapsed)
+        self.timer.maybe_report({"rows": self.rows_written, "last_rows": len(rows),
+                                 "dropped": self.dropped})
+
+    def _failed(self, rows, e):
+        metrics.DB_ROWS.inc(len(rows), result="failed")
+        print(f"DB error, discarded {len(rows)} behavior rows:", e)
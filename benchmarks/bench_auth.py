@@ -0,0 +1,110 @@
+"""Login throughput and per-request auth overhead.
+
+    python -m benchmarks.bench_auth [--logins 64] [--requests 2000] [--rounds 12]
+
+Runs against a throw-away SQLite database; nothing in the app DB is touched.
+"""
+import argparse, asyncio, json, os, statistics, tempfile, time
+
+
+def _pct(vals, q):
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(len(vals) * q))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logins", type=int, default=64, help="concurrent logins")
+    ap.add_argument("--requests", type=int, default=2000, help="authenticated requests")
+    ap.add_argument("--rounds", type=int, default=None, help="bcrypt cost factor")
+    args = ap.parse_args()
+    if args.rounds:
+        os.environ["SANAD_BCRYPT_ROUNDS"] = str(args.rounds)
+
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from backend import auth
+    from backend.db_models import Base
+
+    tmp = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{tmp}/bench.sqlite3", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def create_and_login():
+        db = SessionLocal()
+        await auth.create_user(db, "bench", "bench@example.com", "secret", True)
+        db.close()
+
+        async def one():
+            db = SessionLocal()
+            try:
+                t0 = time.perf_counter()
+                res = await auth.login(db, "bench@example.com", "secret")
+                return time.perf_counter() - t0, res["token"]
+            finally:
+                db.close()
+
+        t0 = time.perf_counter()
+        out = await asyncio.gather(*(one() for _ in range(args.logins)))
+        return time.perf_counter() - t0, out
+
+    wall, out = asyncio.run(create_and_login())
+    lat = [o[0] for o in out]
+    token = out[0][1]
+    report = {
+        "bcrypt_rounds": auth.BCRYPT_ROUNDS,
+        "hash_workers": auth.HASH_WORKERS,
+        "login": {
+            "n": args.logins,
+            "per_sec": round(args.logins / wall, 1),
+            "p50_ms": round(_pct(lat, 0.5) * 1000, 1),
+            "p95_ms": round(_pct(lat, 0.95) * 1000, 1),
+        },
+    }
+
+    app = FastAPI()
+
+    @app.get("/me")
+    def me(u=Depends(auth.get_current_user)):
+        return {"sub": u["sub"]}
+
+    @app.get("/open")
+    def open_():
+        return {}
+
+    headers = {"Authorization": f"Bearer {token}"}
+    with TestClient(app) as c:
+        def timed(path, hdrs, n):
+            vals = []
+            for _ in range(n):
+                t0 = time.perf_counter()
+                c.get(path, headers=hdrs)
+                vals.append(time.perf_counter() - t0)
+            return vals
+
+        base = timed("/open", {}, args.requests)
+        auth.token_cache.clear()
+        auth.token_cache.maxsize, size = 0, auth.token_cache.maxsize
+        cold = timed("/me", headers, args.requests)
+        auth.token_cache.maxsize = size
+        warm = timed("/me", headers, args.requests)
+
+    def summary(vals):
+        return {"mean_us": round(statistics.mean(vals) * 1e6, 1),
+                "p95_us": round(_pct(vals, 0.95) * 1e6, 1)}
+
+    report["request"] = {
+        "no_auth": summary(base),
+        "auth_uncached": summary(cold),
+        "auth_cached": summary(warm),
+        "overhead_uncached_us": round((statistics.mean(cold) - statistics.mean(base)) * 1e6, 1),
+        "overhead_cached_us": round((statistics.mean(warm) - statistics.mean(base)) * 1e6, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
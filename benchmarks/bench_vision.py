@@ -0,0 +1,194 @@
+"""Vision hot-path benchmark: per-stage p50/p95/p99, FPS and peak RSS as JSON.
+
+    python -m benchmarks.bench_vision [--video lesson.mp4 | --size 1280x720]
+                                      [--frames 200] [--faces 12] [--out result.json]
+                                      [--compare baseline.json [--tolerance 0.15]]
+
+Needs no camera: frames come from a fixture video (looped) or are synthetic.
+With --compare the run exits 1 when any stage's p95 is more than `tolerance`
+slower than in the baseline, so two commits can be checked against each other.
+"""
+import argparse, json, os, platform, resource, subprocess, sys, time
+import cv2
+import numpy as np
+
+GALLERY_SIZES = (10, 100, 1000)
+
+
+def percentiles(vals):
+    vals = sorted(vals)
+    at = lambda q: vals[min(len(vals) - 1, int(len(vals) * q))]
+    return {
+        "n": len(vals),
+        "mean_ms": round(sum(vals) / len(vals) * 1000, 3),
+        "p50_ms": round(at(0.50) * 1000, 3),
+        "p95_ms": round(at(0.95) * 1000, 3),
+        "p99_ms": round(at(0.99) * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def frame_source(args):
+    """Yield BGR frames: a looped fixture video, or a fixed synthetic set."""
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        if not cap.isOpened():
+            sys.exit(f"cannot open {args.video}")
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = cap.read()
+                if not ok:
+                    sys.exit(f"no frames in {args.video}")
+            yield frame
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    rng = np.random.default_rng(args.seed)
+    frames = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for _ in range(8)]
+    while True:
+        yield from frames
+
+
+def synthetic_faces(frame, n):
+    """A grid of n face boxes, used when the detector is skipped or finds nothing."""
+    h, w = frame.shape[:2]
+    cols = max(1, int(np.ceil(np.sqrt(n))))
+    cw, ch = w // cols, h // cols
+    side = int(min(cw, ch) * 0.8)
+    faces = []
+    for i in range(n):
+        x, y = (i % cols) * cw + (cw - side) // 2, (i // cols) * ch + (ch - side) // 2
+        faces.append({"bbox": [x, y, x + side, y + side], "conf": 0.9,
+                      "landmarks": [(x + side * fx, y + side * fy) for fx, fy in
+                                    ((0.3, 0.4), (0.7, 0.4), (0.5, 0.6), (0.35, 0.8), (0.65, 0.8))],
+                      "track_id": i + 1})
+    return faces
+
+
+def make_gallery(provider, size, rng):
+    from backend.gallery import FaceGallery
+    g = FaceGallery(None, provider)
+    dim = provider.embed(np.zeros((112, 112, 3), np.uint8)).shape[0]
+    vecs = list(rng.standard_normal((size, dim)).astype(np.float32))
+    g._set(list(range(1, size + 1)), [f"student {i}" for i in range(size)], vecs)
+    return g
+
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.bench_vision")
+    ap.add_argument("--video", help="fixture video, looped; default synthetic frames")
+    ap.add_argument("--size", default="1280x720", help="synthetic frame size WxH")
+    ap.add_argument("--frames", type=int, default=200)
+    ap.add_argument("--warmup", type=int, default=5)
+    ap.add_argument("--faces", type=int, default=12, help="synthetic faces per frame")
+    ap.add_argument("--det-size", type=int, default=None)
+    ap.add_argument("--skip", default="", help="comma-separated stages to skip, e.g. detect")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write the JSON report here as well")
+    ap.add_argument("--compare", help="baseline JSON report")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+
+    from backend.helpers import preprocess_face, simple_embedding, get_embedding_provider
+    from backend.behavior import BehaviorStateStore, analyze_faces, classify_behavior
+    from backend.detection import draw_boxes
+    from backend.pipeline import JPEG_QUALITY
+    from backend.tracking import det_size_for
+
+    detector = None
+    if "detect" not in skip:
+        from backend.detection import FaceDetector
+        detector = FaceDetector()
+    img_size = det_size_for(args.det_size)
+    provider = get_embedding_provider()
+    rng = np.random.default_rng(args.seed)
+    galleries = {n: make_gallery(provider, n, rng) for n in GALLERY_SIZES if f"match_{n}" not in skip}
+    store = BehaviorStateStore()
+
+    samples = {}
+
+    def timed(stage, fn, *a, **kw):
+        t0 = time.perf_counter()
+        out = fn(*a, **kw)
+        samples.setdefault(stage, []).append(time.perf_counter() - t0)
+        return out
+
+    frames = frame_source(args)
+    for i in range(args.warmup + args.frames):
+        if i == args.warmup:
+            samples.clear()
+        frame = next(frames).copy()
+        t_frame = time.perf_counter()
+
+        faces = timed("detect", detector.predict, frame, img_size=img_size) if detector else []
+        if not faces:
+            faces = synthetic_faces(frame, args.faces)
+        crops = timed("preprocess", lambda: [c for c in (preprocess_face(frame, f["bbox"]) for f in faces)
+                                              if c is not None])
+        if "embed_simple" not in skip:
+            timed("embed_simple", lambda: [simple_embedding(c) for c in crops])
+        embs = timed("embed", provider.embed_many, crops)
+        for n, g in galleries.items():
+            timed(f"match_{n}", g.match, list(embs))
+        analyses = timed("behavior", analyze_faces, frame, faces, None, store) if "behavior" not in skip else None
+        if "behavior_per_face" not in skip:
+            timed("behavior_per_face", lambda: [classify_behavior(frame, f["bbox"], f["landmarks"],
+                                                                   student_key=str(j))
+                                                for j, f in enumerate(faces)])
+        timed("draw", draw_boxes, frame, faces, None, analyses)
+        timed("encode", cv2.imencode, ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        samples.setdefault("frame", []).append(time.perf_counter() - t_frame)
+
+    total = sum(samples["frame"])
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "source": args.video or f"synthetic {args.size}",
+            "frames": args.frames,
+            "faces_per_frame": args.faces if not detector else None,
+            "det_size": img_size,
+            "embedder": provider.name,
+            "detector": None if detector is None else f"{detector.backend}/{detector.precision}",
+        },
+        "stages": {k: percentiles(v) for k, v in samples.items()},
+        "fps": round(len(samples["frame"]) / total, 2) if total else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        worse = []
+        for stage, cur in report["stages"].items():
+            old = base.get("stages", {}).get(stage)
+            if old and old["p95_ms"] > 0 and cur["p95_ms"] > old["p95_ms"] * (1 + args.tolerance):
+                worse.append(f"{stage}: p95 {old['p95_ms']} -> {cur['p95_ms']} ms")
+        for line in worse:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if worse else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -118,7 +118,7 @@ export function StreamPage(page) {
             $text.text('Stop');
             $container.css('background', 'none');
 
-            const src = `${base}/detect/stream?session_id=${sessionId}&_=${Date.now()}`;
+            const src = `${base}/detect/stream?session_id=${sessionId}&adaptive=true&_=${Date.now()}`;
 
             $live.off('load error');
             $live.attr('src', '');
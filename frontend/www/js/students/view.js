@@ -19,13 +19,21 @@ export function StudentViewPage(page) {
             $page.find('#student-class').text(s.class_name || 'No class');
             $page.find('#student-parent').text(s.parent_email || 'N/A');
 
-            const list = $page.find('#behaviors-list');
-            list.html('');
+            await Promise.all([loadSummary(), loadBehaviors()]);
+        } catch (err) {
+            const msg =
+                typeof err === 'string'
+                    ? err
+                    : err.detail || err.message || 'Failed to load student';
+            app.dialog.alert(msg, 'Error');
+        }
+    }
+
+    let nextCursor = null;
 
-            if (s.behaviors && s.behaviors.length) {
-                s.behaviors.forEach((b) => {
-                    const bgStyle = b.is_exam && b.behavior !== 'attentive' ? 'background-color: #f8d7da;' : '';
-                    list.append(`
+    function behaviorItem(b) {
+        const bgStyle = b.is_exam && b.behavior !== 'attentive' ? 'background-color: #f8d7da;' : '';
+        return `
             <li style="${bgStyle}">
               <div class="item-content">
                   <div class="item-inner">
@@ -37,10 +45,32 @@ export function StudentViewPage(page) {
                   </div>
               </div>
             </li>
-          `);
-                });
-            } else {
-                list.append(`
+          `;
+    }
+
+    async function loadSummary() {
+        const rows = await api(`/behaviors/summary?student_id=${id}&group_by=behavior`);
+        const box = $page.find('#behavior-summary');
+        box.html('');
+        if (!rows.length) {
+            box.append('<span class="text-color-gray">No behaviors recorded</span>');
+            return;
+        }
+        rows.forEach((r) => {
+            box.append(`<div class="chip"><div class="chip-label">${r.behavior}: ${r.count}</div></div> `);
+        });
+    }
+
+    async function loadBehaviors(more = false) {
+        const list = $page.find('#behaviors-list');
+        const qs = more && nextCursor ? `&cursor=${encodeURIComponent(nextCursor)}` : '';
+        const res = await api(`/students/${id}/behaviors?limit=50${qs}`);
+        if (!more) list.html('');
+
+        if (res.items && res.items.length) {
+            res.items.forEach((b) => list.append(behaviorItem(b)));
+        } else if (!more) {
+            list.append(`
           <li>
             <div class="item-content">
               <div class="item-inner">
@@ -49,16 +79,19 @@ export function StudentViewPage(page) {
             </div>
           </li>
         `);
-            }
-        } catch (err) {
-            const msg =
-                typeof err === 'string'
-                    ? err
-                    : err.detail || err.message || 'Failed to load student';
-            app.dialog.alert(msg, 'Error');
         }
+        nextCursor = res.next_cursor;
+        $page.find('#behaviors-more')[nextCursor ? 'show' : 'hide']();
     }
 
+    $page.find('#behaviors-more').on('click', async () => {
+        try {
+            await loadBehaviors(true);
+        } catch (err) {
+            app.dialog.alert(err.detail || err.message || 'Failed to load behaviors', 'Error');
+        }
+    });
+
     // Show edit/delete only for teachers
     if (user.is_teacher) {
         $page.find('#edit-student-btn').on('click', () => {
@@ -0,0 +1,93 @@
+"""Statement counts of the hot read endpoints must not grow with the data.
+
+Runs the app against a seeded in-memory SQLite DB and counts every statement
+with a before_cursor_execute listener (guards the selectinload/joinedload
+fixes against N+1 regressions).
+"""
+import os
+
+os.environ.setdefault("SANAD_DB_URL", "sqlite://")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import backend.main as main
+from backend.auth import get_current_user
+from backend.database import make_engine
+from backend.db_models import Base, User, Student, Session as DBSession, Behavior
+
+TEACHER = {"sub": 1, "is_teacher": True}
+
+
+@pytest.fixture
+def app():
+    engine = make_engine("sqlite://", poolclass=StaticPool,
+                         connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    Local = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    def get_db():
+        db = Local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, stmt, *a: statements.append(stmt))
+    main.app.dependency_overrides[main.get_db] = get_db
+    main.app.dependency_overrides[get_current_user] = lambda: TEACHER
+    with Local() as db:
+        db.add(User(id=1, name="T", email="t@x.com", password_hash="-", is_teacher=True))
+        db.add(DBSession(id=1, teacher_id=1))
+        db.commit()
+    yield TestClient(main.app), Local, statements
+    main.app.dependency_overrides.clear()
+    engine.dispose()
+
+
+def seed(Local, start, n):
+    """n more students, each with its own parent and a few behavior rows."""
+    with Local() as db:
+        for i in range(start, start + n):
+            parent = User(name=f"P{i}", email=f"p{i}@x.com", password_hash="-")
+            student = Student(full_name=f"S{i}", class_name="5A", parent=parent)
+            student.behaviors = [Behavior(session_id=1, behavior="talking") for _ in range(3)]
+            db.add(student)
+        db.commit()
+
+
+def count(client, statements, url):
+    statements.clear()
+    r = client.get(url)
+    assert r.status_code == 200, r.text
+    return len(statements), r.json()
+
+
+def test_list_students_constant_queries(app):
+    client, Local, statements = app
+    seed(Local, 0, 1)
+    small, body = count(client, statements, "/students")
+    assert len(body) == 1
+    seed(Local, 1, 40)
+    large, body = count(client, statements, "/students")
+    assert len(body) == 41
+    assert all(s["parent_email"] for s in body)
+    assert large == small
+
+
+def test_get_student_constant_queries(app):
+    client, Local, statements = app
+    seed(Local, 0, 1)
+    small, body = count(client, statements, "/students/1")
+    assert body["parent_email"] == "p0@x.com"
+    seed(Local, 1, 40)
+    with Local() as db:
+        db.add_all(Behavior(session_id=1, student_id=1, behavior="sleeping") for _ in range(50))
+        db.commit()
+    large, _ = count(client, statements, "/students/1")
+    assert large == small